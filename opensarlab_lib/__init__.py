@@ -14,6 +14,9 @@ from .util import *
 from .widgets import *
 from .product_name_parse import *
 from .plot import *
+from .temporal_stats import *
+from .stack_export import *
+from .tile_cache import *
 
 try:
     __version__ = version(__name__)
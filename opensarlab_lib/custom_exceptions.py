@@ -9,4 +9,11 @@ class UnexpectedFileExtension(Exception):
     """
     Raise when encountering an unexpected file extension
     """
-    pass
\ No newline at end of file
+    pass
+
+
+class ProjectionError(Exception):
+    """
+    Raise when a stack of rasters does not share a single projection
+    """
+    pass
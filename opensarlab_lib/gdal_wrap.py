@@ -1,12 +1,22 @@
+from collections import OrderedDict
+from contextlib import contextmanager
+import json
+import os
 from pathlib import Path
 import re
 import subprocess
-from typing import List, Union
+import threading
+from typing import TYPE_CHECKING, ContextManager, Dict, Iterator, List, Optional, Tuple, Union
+from uuid import uuid4
 
 import numpy as np
 from osgeo import gdal
 
-from .custom_exceptions import VRTError, UnexpectedFileExtension
+from .custom_exceptions import VRTError, UnexpectedFileExtension, ProjectionError
+from .product_name_parse import date_from_product_name, get_polarity_from_path
+
+if TYPE_CHECKING:
+    from .tile_cache import TileCache
 
 
 def vrt_to_gtiff(vrt: Union[Path, str], output: Union[Path, str]):
@@ -101,6 +111,193 @@ def remove_nan_filled_tifs(tifs: List[Union[Path, str]]):
     print(f"GeoTiffs Removed:  {removed}")
     
     
+def group_tifs_by_projection(tifs: List[Union[Path, str]]) -> Dict[Union[str, None], List[Path]]:
+    """
+    Groups a stack of geotiffs by EPSG code
+
+    tifs: list of string or posix paths to a stack of geotiffs
+
+    returns: a dictionary of string EPSG codes (None if not found) to lists of paths, largest group first
+    """
+    groups = {}
+    for tif in tifs:
+        groups.setdefault(get_projection(tif), []).append(Path(tif))
+    return dict(sorted(groups.items(), key=lambda group: len(group[1]), reverse=True))
+
+
+def _check_single_projection(tifs: List[Union[Path, str]]):
+    """
+    Takes: a list of string or posix paths to a stack of geotiffs
+
+    Raises a ProjectionError if the stack spans more than one projection
+    """
+    epsgs = list(group_tifs_by_projection(tifs))
+    if len(epsgs) > 1:
+        raise ProjectionError(f"Stack spans multiple projections (EPSG: {epsgs}). "
+                              f"Use normalize_stack_projection to warp it to a common grid.")
+
+
+def _get_aligned_stack_grid(tifs: List[Union[Path, str]]) -> Tuple[Tuple[float, ...], str, int, int, List[int]]:
+    """
+    Takes: a list of string or posix paths to a stack of geotiffs
+
+    Raises a ProjectionError if the stack spans more than one projection,
+    or a ValueError if the geotiffs do not share a single pixel grid
+
+    Returns: the stack's geotransform, projection, x size, y size, and native (x, y) block size
+    """
+    tifs = [str(tif) for tif in tifs]
+    _check_single_projection(tifs)
+    reference = gdal.Open(tifs[0])
+    if reference is None:
+        raise FileNotFoundError(tifs[0])
+    geotransform = reference.GetGeoTransform()
+    projection = reference.GetProjection()
+    xsize, ysize = reference.RasterXSize, reference.RasterYSize
+    native_block = reference.GetRasterBand(1).GetBlockSize()
+    reference = None
+    for tif in tifs[1:]:
+        info = gdal.Info(tif, format='json')
+        if info['size'] != [xsize, ysize] or not np.allclose(info['geoTransform'], geotransform):
+            raise ValueError(f"{tif} is not pixel-aligned with {tifs[0]}")
+    return geotransform, projection, xsize, ysize, native_block
+
+
+def _snap_to_grid(extents: List[float], resolution: float, inward: bool) -> Tuple[float, float, float, float]:
+    """
+    Takes: extents in the format [upper-left-x, lower-right-y, lower-right-x, upper-left-y],
+    a pixel size, and whether to snap inward (shrinking the extents) or outward (growing them)
+
+    Returns: the extents snapped to multiples of the pixel size, as (min-x, min-y, max-x, max-y)
+    """
+    low, high = (np.ceil, np.floor) if inward else (np.floor, np.ceil)
+    pixels = np.asarray(extents, dtype=np.float64) / resolution
+    # ignore floating point noise when an extent already lies on the grid
+    pixels = np.where(np.isclose(pixels, np.round(pixels), rtol=0, atol=1e-6), np.round(pixels), pixels)
+    return (float(low(pixels[0]) * resolution), float(low(pixels[1]) * resolution),
+            float(high(pixels[2]) * resolution), float(high(pixels[3]) * resolution))
+
+
+def normalize_stack_projection(tifs: List[Union[Path, str]],
+                               output_dir: Optional[Union[Path, str]] = None,
+                               target_epsg: Optional[str] = None,
+                               resolution: Optional[float] = None,
+                               extents: Optional[Union[str, List[float]]] = 'max',
+                               materialize: Optional[bool] = False,
+                               resample_alg: Optional[str] = 'bilinear',
+                               warp_memory: Optional[int] = 512,
+                               num_threads: Optional[Union[int, str]] = 'ALL_CPUS') -> List[Path]:
+    """
+    Puts a stack of geotiffs, which may span more than one projection (e.g. two UTM zones),
+    onto a single pixel grid with shared extents, so every output has the same size and geotransform.
+
+    Geotiffs in another projection, or off the target grid, are warped with multithreaded gdal.Warp.
+    Geotiffs already on the target grid are only windowed to the shared extents, without resampling.
+    Outputs are VRTs (nothing is materialized; pixels are warped on read) or, if materialize is True,
+    tiled, DEFLATE compressed geotiffs.
+
+    tifs: list of string or posix paths to a stack of geotiffs
+    output_dir: directory for the outputs (defaults to each geotiff's own directory)
+    target_epsg: string EPSG code of the target projection (defaults to the most common in the stack)
+    resolution: target pixel size (defaults to that of the first geotiff in the target projection)
+    extents: 'max', 'common', or [upper-left-x, lower-right-y, lower-right-x, upper-left-y]
+             in the target projection. 'common' extents are snapped inward to the target grid,
+             all others outward.
+    materialize: write geotiffs instead of VRTs
+    resample_alg: gdal resampling algorithm
+    warp_memory: gdal warp memory limit in MB
+    num_threads: number of warping threads, or 'ALL_CPUS'
+
+    returns: list of paths to the normalized stack, in the order of tifs
+    """
+    groups = group_tifs_by_projection(tifs)
+    if target_epsg is None:
+        target_epsg = next(iter(groups))
+    if target_epsg is None:
+        raise ProjectionError("Could not determine an EPSG code for the stack")
+    target_epsg = str(target_epsg)
+
+    if resolution is None:
+        reference = groups[target_epsg][0] if target_epsg in groups else Path(tifs[0])
+        raster = gdal.Open(str(reference))
+        if raster is None:
+            raise FileNotFoundError(reference)
+        resolution = abs(raster.GetGeoTransform()[1])
+        raster = None
+
+    on_grid = []
+    footprints = []
+    for tif in tifs:
+        if get_projection(tif) == target_epsg:
+            info = gdal.Info(str(tif), format='json')
+            gt, size = info['geoTransform'], info['size']
+            on_grid.append(bool(np.isclose(abs(gt[1]), resolution) and np.isclose(abs(gt[5]), resolution)
+                                and np.isclose(np.remainder(gt[0] / resolution + 0.5, 1), 0.5)
+                                and np.isclose(np.remainder(gt[3] / resolution + 0.5, 1), 0.5)))
+        else:
+            # an in-memory warped VRT, only used to find the geotiff's footprint in the target projection
+            warped = gdal.Warp('', str(tif), format='VRT', dstSRS=f"EPSG:{target_epsg}")
+            if warped is None:
+                raise RuntimeError(f"gdal.Warp failed to warp {tif}")
+            gt, size = warped.GetGeoTransform(), [warped.RasterXSize, warped.RasterYSize]
+            warped = None
+            on_grid.append(False)
+        footprints.append([gt[0], gt[3] + size[1] * gt[5], gt[0] + size[0] * gt[1], gt[3]])
+
+    if extents == 'max':
+        bounds = _snap_to_grid([min(f[0] for f in footprints), min(f[1] for f in footprints),
+                                max(f[2] for f in footprints), max(f[3] for f in footprints)],
+                               resolution, inward=False)
+    elif extents == 'common':
+        bounds = _snap_to_grid([max(f[0] for f in footprints), max(f[1] for f in footprints),
+                                min(f[2] for f in footprints), min(f[3] for f in footprints)],
+                               resolution, inward=True)
+    else:
+        bounds = _snap_to_grid(extents, resolution, inward=False)
+    if bounds[0] >= bounds[2] or bounds[1] >= bounds[3]:
+        raise ValueError(f"The extents {bounds} are empty")
+
+    creation_options = ['COMPRESS=DEFLATE', 'TILED=YES', f"NUM_THREADS={num_threads}"]
+    warp_options = gdal.WarpOptions(
+        format='GTiff' if materialize else 'VRT',
+        dstSRS=f"EPSG:{target_epsg}",
+        xRes=resolution,
+        yRes=resolution,
+        outputBounds=bounds,
+        resampleAlg=resample_alg,
+        multithread=True,
+        warpMemoryLimit=warp_memory,
+        warpOptions=[f"NUM_THREADS={num_threads}"],
+        creationOptions=creation_options if materialize else None
+    )
+    vrt_options = gdal.BuildVRTOptions(outputBounds=bounds, resolution='user', xRes=resolution, yRes=resolution)
+
+    normalized = []
+    for tif, aligned in zip(tifs, on_grid):
+        tif = Path(tif)
+        out_dir = Path(output_dir) if output_dir else tif.parent
+        out_dir.mkdir(parents=True, exist_ok=True)
+        suffix = f"_EPSG{target_epsg}.{'tif' if materialize else 'vrt'}"
+        output = out_dir / f"{tif.stem}{suffix}"
+        duplicate = 1
+        while output in normalized or output == tif:
+            output = out_dir / f"{tif.stem}_{duplicate}{suffix}"
+            duplicate += 1
+
+        if aligned and materialize:
+            out = gdal.Translate(str(output), gdal.BuildVRT('', [str(tif)], options=vrt_options),
+                                 creationOptions=creation_options)
+        elif aligned:
+            out = gdal.BuildVRT(str(output), [str(tif)], options=vrt_options)
+        else:
+            out = gdal.Warp(str(output), str(tif), options=warp_options)
+        if out is None:
+            raise RuntimeError(f"gdal failed to write {output}")
+        out = None
+        normalized.append(output)
+    return normalized
+
+
 def get_max_extents(tifs: List[Union[Path, str]]):
     """
     Finds the total footprint covered by a stack of geotiffs
@@ -111,6 +308,7 @@ def get_max_extents(tifs: List[Union[Path, str]]):
              in the format [upper-left-x, lower-right-y, lower-right-x, upper-left-y]
     
     """
+    _check_single_projection(tifs)
     corners = [gdal.Info(str(tif), format='json')['cornerCoordinates'] for tif in tifs]
     ulx = min(corner['upperLeft'][0] for corner in corners)
     uly = max(corner['upperLeft'][1] for corner in corners)
@@ -129,9 +327,437 @@ def get_common_coverage_extents(tifs: List[Union[Path, str]]):
              in the format [upper-left-x, lower-right-y, lower-right-x, upper-left-y]
     
     """
+    _check_single_projection(tifs)
     corners = [gdal.Info(str(tif), format='json')['cornerCoordinates'] for tif in tifs]
     ulx = max(corner['upperLeft'][0] for corner in corners)
     uly = min(corner['upperLeft'][1] for corner in corners)
     lrx = min(corner['lowerRight'][0] for corner in corners)
     lry = max(corner['lowerRight'][1] for corner in corners)
     return [ulx, lry, lrx, uly]
+
+
+def _get_file_identity(tif: str) -> str:
+    """
+    Takes: a string path to a raster
+
+    Returns: a string identifying the file's current contents by its resolved path, size, and
+             modification time, or just the path for gdal virtual filesystem (e.g. /vsimem/) paths
+    """
+    try:
+        stat = os.stat(tif)
+    except OSError:
+        return tif
+    return f"{os.path.realpath(tif)}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def _get_max_open_datasets() -> int:
+    """
+    Returns: the number of datasets to keep open per process, a quarter of the soft open file limit
+             (between 16 and 1024), leaving the rest of the limit to gdal's own handles and the caller
+    """
+    try:
+        import resource
+        soft = resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+    except (ImportError, OSError, ValueError):
+        soft = 1024
+    if soft < 0:
+        # RLIM_INFINITY
+        soft = 4096
+    return min(1024, max(16, soft // 4))
+
+
+class _DatasetPool:
+    """
+    A process-wide pool of open gdal.Datasets shared by every thread, so rasters are not reopened
+    (and their headers re-read) for every block. gdal.Datasets are not thread-safe, so each dataset
+    is lent to one thread at a time, and a thread borrowing a raster that is already lent out opens
+    another dataset for it. Idle datasets are closed, least recently used first, whenever more than
+    max_open datasets are open, and a raster is reopened once its file changes.
+    """
+
+    def __init__(self, max_open: int):
+        self.max_open = max_open
+        self._lock = threading.Lock()
+        self._idle = {}
+        self._order = OrderedDict()
+        self._open = 0
+
+    @property
+    def open_count(self) -> int:
+        """
+        Returns: the number of datasets currently open, idle or lent
+        """
+        return self._open
+
+    def _trim(self):
+        """
+        Closes the least recently used idle datasets until at most max_open datasets are open
+        """
+        while self._open > self.max_open and self._order:
+            key, tif = self._order.popitem(last=False)
+            self._idle[tif] = [handle for handle in self._idle[tif] if id(handle[1]) != key]
+            if not self._idle[tif]:
+                del self._idle[tif]
+            self._open -= 1
+
+    @contextmanager
+    def lend(self, tif: str) -> Iterator[gdal.Dataset]:
+        """
+        Takes: a string path to a raster
+
+        Yields: an open gdal.Dataset for the raster, for the calling thread's use only
+        """
+        identity = _get_file_identity(tif)
+        raster = None
+        with self._lock:
+            handles = self._idle.get(tif, [])
+            while handles and raster is None:
+                handle_identity, handle = handles.pop()
+                del self._order[id(handle)]
+                if handle_identity == identity:
+                    raster = handle
+                else:
+                    self._open -= 1
+            if not handles:
+                self._idle.pop(tif, None)
+            if raster is None:
+                self._open += 1
+                self._trim()
+        if raster is None:
+            raster = gdal.Open(tif)
+            if raster is None:
+                with self._lock:
+                    self._open -= 1
+                raise FileNotFoundError(tif)
+        try:
+            yield raster
+        finally:
+            with self._lock:
+                self._idle.setdefault(tif, []).append((identity, raster))
+                self._order[id(raster)] = tif
+                self._trim()
+
+    def close(self, tifs: Optional[List[Union[Path, str]]] = None):
+        """
+        Takes: an optional list of string or posix paths to rasters
+
+        Closes the idle datasets of the rasters (or of every raster)
+        """
+        with self._lock:
+            for tif in list(self._idle) if tifs is None else [str(tif) for tif in tifs]:
+                for _, handle in self._idle.pop(tif, []):
+                    del self._order[id(handle)]
+                    self._open -= 1
+
+
+_dataset_pool = _DatasetPool(_get_max_open_datasets())
+
+
+def _open_dataset(tif: str) -> ContextManager[gdal.Dataset]:
+    """
+    Takes: a string path to a raster
+
+    Returns: a context manager lending an open gdal.Dataset for the raster from the process-wide pool
+    """
+    return _dataset_pool.lend(tif)
+
+
+def close_datasets(tifs: Optional[List[Union[Path, str]]] = None):
+    """
+    Closes the datasets that read_window, the TileCache, and the stack statistics and display
+    functions keep open between reads, e.g. to release files on network storage.
+    Those functions close their stack's datasets themselves once they finish.
+
+    tifs: optional list of string or posix paths to the rasters whose datasets to close (defaults to all)
+    """
+    _dataset_pool.close(tifs)
+
+
+def read_window(tif: Union[Path, str], xoff: int, yoff: int, xsize: int, ysize: int,
+                band: Optional[int] = 1, cache: Optional['TileCache'] = None) -> np.ndarray:
+    """
+    Takes: a string or posix path to a raster, a pixel window, an optional band number,
+    and an optional TileCache through which to read
+
+    Returns: the window's data. The raster is kept open for later reads until close_datasets is called.
+    """
+    if cache is not None:
+        return cache.read_window(tif, xoff, yoff, xsize, ysize, band)
+    with _open_dataset(str(tif)) as raster:
+        return raster.GetRasterBand(band).ReadAsArray(xoff, yoff, xsize, ysize)
+
+
+def _get_strip_windows(band: gdal.Band) -> Iterator[Tuple[int, int]]:
+    """
+    Takes: a gdal.Band
+
+    Yields: (yoff, ysize) full-width row strips, one native block high,
+            so every block in the band is decoded exactly once
+    """
+    block_y = band.GetBlockSize()[1]
+    for yoff in range(0, band.YSize, block_y):
+        yield yoff, min(block_y, band.YSize - yoff)
+
+
+def _get_valid_data(block: np.ndarray, nodata: Union[float, int, None]) -> np.ndarray:
+    """
+    Takes: an array of raster data and its nodata value (0 is used when None)
+
+    Returns: a boolean array, True where the data are neither nodata nor NaN
+    """
+    valid = block != (0 if nodata is None else nodata)
+    if np.issubdtype(block.dtype, np.floating):
+        valid &= ~np.isnan(block)
+    return valid
+
+
+def _get_mask_sidecar_paths(tif: Union[Path, str]) -> Tuple[Path, Path]:
+    """
+    Takes: a string or posix path to a geotiff
+
+    Returns: the paths to its packed validity mask (.npy) and mask metadata (.json) sidecars
+    """
+    return Path(f"{tif}.valid.npy"), Path(f"{tif}.valid.json")
+
+
+def write_validity_masks(tifs: List[Union[Path, str]], overwrite: Optional[bool] = False,
+                         cache: Optional['TileCache'] = None) -> List[Path]:
+    """
+    Streams each geotiff once, block by block, and writes a bit-packed (np.packbits)
+    validity mask sidecar next to it, along with a small json file holding the
+    mask's shape, geotransform, projection, and valid pixel count.
+
+    Pixels equal to the band's nodata value (0 if none is set) or NaN are invalid.
+    Sidecars newer than their geotiff are reused unless overwrite is True.
+
+    tifs: list of string or posix paths to a stack of geotiffs
+    overwrite: rewrite sidecars even if they are up to date
+    cache: an optional TileCache through which to read the geotiffs
+
+    returns: a list of paths to the packed mask sidecars
+    """
+    masks = []
+    for tif in tifs:
+        tif = Path(tif)
+        mask_path, meta_path = _get_mask_sidecar_paths(tif)
+        masks.append(mask_path)
+        if (not overwrite and mask_path.exists() and meta_path.exists()
+                and mask_path.stat().st_mtime >= tif.stat().st_mtime):
+            continue
+
+        raster = gdal.Open(str(tif))
+        if raster is None:
+            raise FileNotFoundError(tif)
+        band = raster.GetRasterBand(1)
+        nodata = band.GetNoDataValue()
+
+        packed = np.lib.format.open_memmap(mask_path, mode='w+', dtype=np.uint8,
+                                           shape=(band.YSize, (band.XSize + 7) // 8))
+        valid_pixels = 0
+        for yoff, ysize in _get_strip_windows(band):
+            if cache is not None:
+                block = cache.read_window(tif, 0, yoff, band.XSize, ysize)
+            else:
+                block = band.ReadAsArray(0, yoff, band.XSize, ysize)
+            valid = _get_valid_data(block, nodata)
+            valid_pixels += int(np.count_nonzero(valid))
+            packed[yoff:yoff + ysize] = np.packbits(valid, axis=1)
+        packed.flush()
+        del packed
+
+        meta = {
+            'shape': [band.YSize, band.XSize],
+            'geotransform': list(raster.GetGeoTransform()),
+            'projection': raster.GetProjection(),
+            'valid_pixels': valid_pixels
+        }
+        with open(meta_path, 'w') as f:
+            json.dump(meta, f)
+        raster = None
+    if cache is not None:
+        close_datasets(tifs)
+    return masks
+
+
+def _read_mask_metadata(tif: Union[Path, str]) -> dict:
+    """
+    Takes: a string or posix path to a geotiff with validity mask sidecars
+
+    Raises a FileNotFoundError if the sidecars are missing, or a ValueError if they are older than the geotiff
+
+    Returns: the mask metadata dictionary
+    """
+    mask_path, meta_path = _get_mask_sidecar_paths(tif)
+    if not mask_path.exists() or not meta_path.exists():
+        raise FileNotFoundError(f"No validity mask found for {tif}. Run write_validity_masks first.")
+    if mask_path.stat().st_mtime < Path(tif).stat().st_mtime:
+        raise ValueError(f"The validity mask of {tif} is older than {tif}. Run write_validity_masks again.")
+    with open(meta_path) as f:
+        return json.load(f)
+
+
+def read_validity_mask(tif: Union[Path, str]) -> np.ndarray:
+    """
+    Takes: a string or posix path to a geotiff with validity mask sidecars
+
+    Returns: a boolean array, True where the geotiff holds valid data
+    """
+    mask_path = _get_mask_sidecar_paths(tif)[0]
+    cols = _read_mask_metadata(tif)['shape'][1]
+    packed = np.load(mask_path, mmap_mode='r')
+    return np.unpackbits(packed, axis=1, count=cols).astype(bool)
+
+
+def get_empty_tifs(tifs: List[Union[Path, str]]) -> List[Path]:
+    """
+    Finds the geotiffs in a stack that contain no valid data, using only their validity mask sidecars
+
+    tifs: list of string or posix paths to a stack of geotiffs with validity mask sidecars
+
+    returns: a list of paths to the geotiffs without valid data
+    """
+    return [Path(tif) for tif in tifs if _read_mask_metadata(tif)['valid_pixels'] == 0]
+
+
+def _get_coverage_count(tifs: List[Union[Path, str]]) -> Tuple[np.ndarray, List[float], str]:
+    """
+    Takes: a list of string or posix paths to a stack of geotiffs with validity mask sidecars
+
+    Returns: a uint16 per-pixel count of valid acquisitions over the stack's total footprint,
+             along with the footprint's geotransform and projection
+    """
+    metas = [_read_mask_metadata(tif) for tif in tifs]
+    if not metas:
+        raise ValueError("No geotiffs passed")
+
+    projection = metas[0]['projection']
+    x_res, y_res = metas[0]['geotransform'][1], metas[0]['geotransform'][5]
+    for tif, meta in zip(tifs, metas):
+        if meta['projection'] != projection:
+            raise ProjectionError(f"{tif} does not share the stack's projection")
+        if not np.isclose(meta['geotransform'][1], x_res) or not np.isclose(meta['geotransform'][5], y_res):
+            raise ValueError(f"{tif} does not share the stack's pixel size")
+
+    ulx = min(meta['geotransform'][0] for meta in metas)
+    uly = max(meta['geotransform'][3] for meta in metas)
+    lrx = max(meta['geotransform'][0] + meta['shape'][1] * x_res for meta in metas)
+    lry = min(meta['geotransform'][3] + meta['shape'][0] * y_res for meta in metas)
+    rows = int(round((lry - uly) / y_res))
+    cols = int(round((lrx - ulx) / x_res))
+
+    count = np.zeros((rows, cols), dtype=np.uint16)
+    for tif, meta in zip(tifs, metas):
+        x_off = (meta['geotransform'][0] - ulx) / x_res
+        y_off = (meta['geotransform'][3] - uly) / y_res
+        if not np.isclose(x_off, round(x_off), atol=1e-3) or not np.isclose(y_off, round(y_off), atol=1e-3):
+            raise ValueError(f"{tif} is not on the stack's pixel grid")
+        x_off, y_off = int(round(x_off)), int(round(y_off))
+        mask_rows, mask_cols = meta['shape']
+        packed = np.load(_get_mask_sidecar_paths(tif)[0], mmap_mode='r')
+        step = max(1, 2**24 // max(1, mask_cols))
+        for r in range(0, mask_rows, step):
+            valid = np.unpackbits(packed[r:r + step], axis=1, count=mask_cols)
+            count[y_off + r:y_off + r + valid.shape[0], x_off:x_off + mask_cols] += valid
+    geotransform = [ulx, x_res, 0.0, uly, 0.0, y_res]
+    return count, geotransform, projection
+
+
+def get_coverage_count(tifs: List[Union[Path, str]], output: Optional[Union[Path, str]] = None) -> np.ndarray:
+    """
+    Counts the number of acquisitions with valid data at each pixel of a stack's total footprint,
+    using only the stack's validity mask sidecars (see write_validity_masks)
+
+    tifs: list of string or posix paths to a stack of geotiffs with validity mask sidecars
+    output: optional string or posix path to which to write the count as a uint16 geotiff
+
+    returns: a uint16 array of per-pixel valid acquisition counts
+    """
+    count, geotransform, projection = _get_coverage_count(tifs)
+    if output:
+        driver = gdal.GetDriverByName('GTiff')
+        out = driver.Create(str(output), count.shape[1], count.shape[0], 1, gdal.GDT_UInt16,
+                            options=['COMPRESS=DEFLATE', 'TILED=YES'])
+        out.SetGeoTransform(geotransform)
+        out.SetProjection(projection)
+        out.GetRasterBand(1).WriteArray(count)
+        out.FlushCache()
+        out = None
+    return count
+
+
+def get_valid_coverage_extents(tifs: List[Union[Path, str]], min_count: Optional[int] = None) -> Union[List[float], None]:
+    """
+    Finds the footprint of the pixels holding valid data in at least min_count geotiffs of a stack,
+    using only the stack's validity mask sidecars (see write_validity_masks)
+
+    tifs: list of string or posix paths to a stack of geotiffs with validity mask sidecars
+    min_count: minimum number of valid acquisitions per pixel (defaults to every geotiff in the stack)
+
+    returns: extents for the footprint in the format [upper-left-x, lower-right-y, lower-right-x, upper-left-y]
+             or None if no pixel has enough valid acquisitions
+    """
+    count, geotransform, _ = _get_coverage_count(tifs)
+    covered = count >= (len(tifs) if min_count is None else min_count)
+    rows = np.flatnonzero(covered.any(axis=1))
+    cols = np.flatnonzero(covered.any(axis=0))
+    if rows.size == 0:
+        return None
+    ulx, x_res, _, uly, _, y_res = geotransform
+    return [float(ulx + cols[0] * x_res), float(uly + (rows[-1] + 1) * y_res),
+            float(ulx + (cols[-1] + 1) * x_res), float(uly + rows[0] * y_res)]
+
+
+def build_time_series_vrt(tifs: List[Union[Path, str]],
+                          output: Optional[Union[Path, str]] = None,
+                          extents: Optional[Union[str, List[float]]] = 'max',
+                          in_memory: Optional[bool] = False) -> str:
+    """
+    Builds a multi-band VRT from a stack of HyP3 geotiffs, with one band per geotiff, ordered
+    by acquisition date (then polarization). Each band's description is '<date>_<polarization>'
+    and its metadata holds its ACQUISITION_DATE, POLARIZATION, and SOURCE path.
+
+    The whole stack can then be opened as a single dataset and read with one
+    ReadAsArray(xoff, yoff, xsize, ysize) call per block, returning a (band, y, x) array.
+
+    tifs: list of string or posix paths to a stack of HyP3 geotiffs sharing a projection
+    output: string or posix path to the output VRT (only its filename is used if in_memory).
+            In-memory VRTs get a unique name if output is omitted.
+    extents: 'max', 'common', or [upper-left-x, lower-right-y, lower-right-x, upper-left-y]
+             (see get_max_extents and get_common_coverage_extents)
+    in_memory: write the VRT to gdal's /vsimem/ in-memory filesystem instead of to disk.
+               Release it with gdal.Unlink(path) when done.
+
+    returns: the string path to the VRT
+    """
+    if output is None and not in_memory:
+        raise ValueError("Pass an output path or set in_memory=True")
+    if in_memory:
+        output = f"/vsimem/{Path(output).name if output else f'time_series_{uuid4().hex}.vrt'}"
+    output = str(output)
+
+    bands = []
+    for tif in tifs:
+        dt = date_from_product_name(tif)
+        if dt is None:
+            raise ValueError(f"Could not parse an acquisition date from {tif}")
+        bands.append((dt, get_polarity_from_path(tif) or '', str(tif)))
+    bands.sort()
+
+    if extents == 'max':
+        extents = get_max_extents(tifs)
+    elif extents == 'common':
+        extents = get_common_coverage_extents(tifs)
+    else:
+        _check_single_projection(tifs)
+
+    options = gdal.BuildVRTOptions(separate=True, outputBounds=extents, resolution='highest')
+    vrt = gdal.BuildVRT(output, [band[2] for band in bands], options=options)
+    if vrt is None:
+        raise RuntimeError(f"gdal.BuildVRT failed to build {output}")
+    for i, (dt, polarization, tif) in enumerate(bands, start=1):
+        band = vrt.GetRasterBand(i)
+        band.SetDescription(f"{dt}_{polarization}" if polarization else dt)
+        band.SetMetadata({'ACQUISITION_DATE': dt, 'POLARIZATION': polarization, 'SOURCE': tif})
+    vrt.FlushCache()
+    vrt = None
+    return output
@@ -1,5 +1,6 @@
+from bisect import bisect_left, bisect_right
 from datetime import date
-from typing import List, Tuple
+from typing import Dict, List, Tuple
 
 from hyp3_sdk import Batch, HyP3
 
@@ -38,6 +39,43 @@ def filter_jobs_by_date(jobs: Batch, date_range: List[date]) -> Batch:
     return remaining_jobs
 
 
+def get_jobs_by_date(jobs: Batch) -> Dict[str, Batch]:
+    """
+    Takes: a Batch of HyP3 Jobs
+
+    Returns: a dictionary of string acquisition dates ('%Y%m%d') to Batches
+             of the Jobs with a granule acquired on that date, sorted by date
+    """
+    jobs_by_date = {}
+    for job in jobs:
+        dates = {date_from_product_name(granule).split('T')[0] for granule in job.job_parameters['granules']}
+        for dt in dates:
+            jobs_by_date.setdefault(dt, Batch())
+            jobs_by_date[dt] += job
+    return dict(sorted(jobs_by_date.items()))
+
+
+def filter_jobs_by_date_index(jobs_by_date: Dict[str, Batch], date_range: List[date]) -> Batch:
+    """
+    Takes: a dictionary of string acquisition dates to Batches of Jobs (from get_jobs_by_date)
+    and a list of two datetime.date objects, the minimum and maximum dates of a range.
+
+    Returns: a filtered Batch of Jobs containing only Jobs falling within date_range,
+             without rescanning the granules of every Job
+    """
+    dates = list(jobs_by_date)
+    start = bisect_left(dates, date_range[0].strftime('%Y%m%d'))
+    stop = bisect_right(dates, date_range[1].strftime('%Y%m%d'))
+    remaining_jobs = Batch()
+    job_ids = set()
+    for dt in dates[start:stop]:
+        for job in jobs_by_date[dt]:
+            if job.job_id not in job_ids:
+                job_ids.add(job.job_id)
+                remaining_jobs += job
+    return remaining_jobs
+
+
 def set_paths_orbits(jobs: Batch):
     """
     Takes: a Batch of HyP3 Jobs
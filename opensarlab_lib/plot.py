@@ -1,57 +1,347 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
+import copy
+import io
 from pathlib import Path
-from typing import List, Optional, Union, Tuple
+from typing import Dict, List, Optional, Sequence, Union, Tuple
 
 import cartopy.crs
 import cartopy.feature as cfeature
+import numpy as np
 import pyproj
 import shapefile  # Requires the pyshp package
 from shapely.geometry import shape
-from shapely.ops import transform
 
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
 import matplotlib.pyplot as plt
 import matplotlib.patches as patches
+
+from .gdal_wrap import _get_strip_windows, _get_valid_data, _open_dataset, close_datasets, read_window
+from .tile_cache import TileCache
+
 plt.rcParams.update({'font.size': 12})
 
-def plot_shape_in_stack(
-    shapefile_path: Union[Path, str], 
-    src_crs: str, 
-    max_extents: List[Union[float, int]], 
-    common_extents: List[Union[float, int]], 
-    figsize:Optional[Tuple[int]]=None):
-    
+
+class DisplayHistogram:
     """
-    Generates a basemap plot showing the maximum and common geographic extents covered by a data stack of geotiffs, and the location of a simple Polygon within
-    those extents (loaded from a shapefile).
-    
-    Args:
-        shapefile_path: the posix or string path to a shapefile conaining a single, simple Polygon in the same projection as your data stack
-        src_crs:        The string EPSG of the data stack
-        extents:        web mercator (EPSG: 3857) max raster extents of entire stack [xmin, ymin, xmax, ymax]
-                            (guaranteed to contain data in at least one raster)
-        common_extents: web mercator (EPSG: 3857) raster extents common to entire stack [xmin, ymin, xmax, ymax]
-                            (guaranteed to contain data in all rasters)
-        figsize: a tuple containing the figure size of the output plot in the format (x_size, y_size)     
+    A constant-memory, mergeable histogram for estimating display limits (e.g. vmin, vmax) over a stack.
+
+    Values are counted in fixed, logarithmically spaced bins of each sign, between min_magnitude and
+    max_magnitude, so every DisplayHistogram with the same layout can be merged by adding counts, no matter
+    which files, blocks, or workers filled it. Quantiles are accurate to within one bin's relative width,
+    about 0.7% with the default layout. Magnitudes below min_magnitude are counted as 0 and magnitudes above
+    max_magnitude are counted in the outermost bins.
     """
-    
-    fig = plt.figure(figsize=figsize)
-    ax = fig.add_subplot(1,1,1, projection=cartopy.crs.Mercator())
-    ax.stock_img()
-    ax.add_feature(cfeature.BORDERS)
-    ax.add_feature(cfeature.COASTLINE)
 
+    def __init__(self, bins_per_sign: Optional[int] = 4096,
+                 min_magnitude: Optional[float] = 1e-6,
+                 max_magnitude: Optional[float] = 1e6):
+        self.bins_per_sign = bins_per_sign
+        self.min_magnitude = min_magnitude
+        self.max_magnitude = max_magnitude
+        self.counts = np.zeros(2 * bins_per_sign + 1, dtype=np.int64)
+        self._log_min = np.log10(min_magnitude)
+        self._bin_width = (np.log10(max_magnitude) - self._log_min) / bins_per_sign
+
+    def update(self, values: np.ndarray):
+        """
+        Takes: an array of values
+
+        Counts the array's non-NaN values
+        """
+        values = np.asarray(values, dtype=np.float64).ravel()
+        values = values[~np.isnan(values)]
+        magnitude = np.abs(values)
+        small = magnitude < self.min_magnitude
+        with np.errstate(divide='ignore'):
+            k = np.floor((np.log10(magnitude) - self._log_min) / self._bin_width)
+        k = np.clip(np.nan_to_num(k, neginf=0), 0, self.bins_per_sign - 1).astype(np.int64)
+        indices = np.where(values > 0, self.bins_per_sign + 1 + k, self.bins_per_sign - 1 - k)
+        indices[small] = self.bins_per_sign
+        self.counts += np.bincount(indices, minlength=self.counts.size)
+
+    def merge(self, other: 'DisplayHistogram') -> 'DisplayHistogram':
+        """
+        Takes: another DisplayHistogram with the same layout
+
+        Adds its counts to this histogram's counts and returns this histogram
+        """
+        if (other.bins_per_sign, other.min_magnitude, other.max_magnitude) != \
+                (self.bins_per_sign, self.min_magnitude, self.max_magnitude):
+            raise ValueError("Only DisplayHistograms with the same layout can be merged")
+        self.counts += other.counts
+        return self
+
+    def percentile(self, q: Union[float, Sequence[float]]) -> Union[float, np.ndarray]:
+        """
+        Takes: a percentile or sequence of percentiles between 0 and 100
+
+        Returns: the estimated percentile(s) of the counted values (NaN if nothing was counted)
+        """
+        total = self.counts.sum()
+        q = np.asarray(q, dtype=np.float64)
+        if total == 0:
+            return np.full(q.shape, np.nan)[()]
+        cumulative = np.cumsum(self.counts)
+        indices = np.searchsorted(cumulative, np.maximum(q / 100 * total, 1))
+        k = np.abs(indices - self.bins_per_sign) - 1
+        magnitude = 10 ** (self._log_min + (k + 0.5) * self._bin_width)
+        return (np.sign(indices - self.bins_per_sign) * magnitude)[()]
+
+    def save(self, path: Union[Path, str]):
+        """
+        Takes: a string or posix path
+
+        Saves the histogram as a .npz file, to be reloaded with DisplayHistogram.load
+        """
+        np.savez(path, counts=self.counts,
+                 layout=[self.bins_per_sign, self.min_magnitude, self.max_magnitude])
+
+    @classmethod
+    def load(cls, path: Union[Path, str]) -> 'DisplayHistogram':
+        """
+        Takes: a string or posix path to a histogram saved with DisplayHistogram.save
+
+        Returns: the DisplayHistogram
+        """
+        with np.load(path) as saved:
+            bins_per_sign, min_magnitude, max_magnitude = saved['layout']
+            histogram = cls(int(bins_per_sign), float(min_magnitude), float(max_magnitude))
+            histogram.counts += saved['counts']
+        return histogram
+
+
+def _get_raster_histogram(tif: Union[Path, str], max_pixels: int,
+                          cache: Optional[TileCache] = None) -> DisplayHistogram:
+    """
+    Takes: a string or posix path to a raster, the approximate maximum number of pixels to sample,
+    and an optional TileCache through which to read
+
+    Returns: a DisplayHistogram of the raster's valid pixels, read from its smallest overview holding
+             at least max_pixels pixels, or else from evenly spaced strips of native blocks spanning
+             the whole raster, decimated so that about max_pixels pixels are sampled in total
+    """
+    tif = str(tif)
+    histogram = DisplayHistogram()
+    with _open_dataset(tif) as raster:
+        band = raster.GetRasterBand(1)
+        nodata = band.GetNoDataValue()
+        overview = None
+        for i in reversed(range(band.GetOverviewCount())):
+            if band.GetOverview(i).XSize * band.GetOverview(i).YSize >= max_pixels:
+                overview = band.GetOverview(i)
+                break
+        if overview is not None:
+            band = overview
+
+        strips = list(_get_strip_windows(band))
+        strip_pixels = band.XSize * strips[0][1]
+        # sample at least 16 strips (when there are that many) so every part of the raster is represented,
+        # and decimate each strip if those strips hold more than max_pixels pixels between them
+        count = min(len(strips), max(16, int(np.ceil(max_pixels / strip_pixels))))
+        decimation = max(1, int(np.ceil(np.sqrt(count * strip_pixels / max_pixels))))
+        sampled = [strips[i] for i in np.unique(np.linspace(0, len(strips) - 1, count).round().astype(int))]
+        if cache is None or overview is not None:
+            for yoff, ysize in sampled:
+                block = band.ReadAsArray(0, yoff, band.XSize, ysize,
+                                         int(np.ceil(band.XSize / decimation)), int(np.ceil(ysize / decimation)))
+                histogram.update(block[_get_valid_data(block, nodata)])
+            return histogram
+        xsize = band.XSize
+
+    for yoff, ysize in sampled:
+        block = read_window(tif, 0, yoff, xsize, ysize, cache=cache)[::decimation, ::decimation]
+        histogram.update(block[_get_valid_data(block, nodata)])
+    return histogram
+
+
+def get_stack_histogram(tifs: List[Union[Path, str]],
+                        max_pixels: Optional[int] = 1_000_000,
+                        max_workers: Optional[int] = None,
+                        cache: Optional[TileCache] = None) -> DisplayHistogram:
+    """
+    Builds a single DisplayHistogram over a stack of geotiffs in one streaming pass,
+    sampling at most about max_pixels pixels from each geotiff (using overviews when present).
+    Nodata (0 if unset) and NaN pixels are excluded.
+
+    The result may be saved (DisplayHistogram.save), merged with histograms of other stacks,
+    and reused to compute consistent display limits for every date in the stack.
+
+    tifs: list of string or posix paths to a stack of geotiffs
+    max_pixels: approximate maximum number of pixels to sample per geotiff
+    max_workers: number of threads reading geotiffs in parallel
+    cache: an optional TileCache through which to read geotiffs without overviews
+
+    returns: a DisplayHistogram of the stack's sampled pixels
+    """
+    histogram = DisplayHistogram()
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            for raster_histogram in pool.map(lambda tif: _get_raster_histogram(tif, max_pixels, cache), tifs):
+                histogram.merge(raster_histogram)
+    finally:
+        close_datasets(tifs)
+    return histogram
+
+
+def get_stack_display_limits(tifs: List[Union[Path, str]],
+                             percentiles: Optional[Tuple[float, float]] = (1, 99),
+                             max_pixels: Optional[int] = 1_000_000,
+                             max_workers: Optional[int] = None,
+                             cache: Optional[TileCache] = None) -> Tuple[float, float]:
+    """
+    Computes a single contrast stretch for every geotiff in a stack, with memory use independent of the
+    stack's size (see get_stack_histogram). Pass the results as vmin and vmax to LineSelector or imshow.
+
+    tifs: list of string or posix paths to a stack of geotiffs
+    percentiles: the lower and upper percentiles (0-100) of the stretch
+    max_pixels: approximate maximum number of pixels to sample per geotiff
+    max_workers: number of threads reading geotiffs in parallel
+    cache: an optional TileCache through which to read geotiffs without overviews
+
+    returns: a (vmin, vmax) tuple
+    """
+    histogram = get_stack_histogram(tifs, max_pixels=max_pixels, max_workers=max_workers, cache=cache)
+    vmin, vmax = histogram.percentile(percentiles)
+    return float(vmin), float(vmax)
+
+
+def _get_lonlat_extent(extent: Tuple[float, float, float, float]) -> Tuple[float, float, float, float]:
+    """
+    Takes: a web mercator (EPSG:3857) map extent [xmin, xmax, ymin, ymax]
+
+    Returns: the extent in longitude and latitude [lon_min, lon_max, lat_min, lat_max]
+    """
+    project = pyproj.Transformer.from_crs(pyproj.CRS('EPSG:3857'), pyproj.CRS('EPSG:4326'), always_xy=True)
+    lons, lats = project.transform(extent[:2], extent[2:])
+    return lons[0], lons[1], lats[0], lats[1]
+
+
+def _get_map_scale(extent: Tuple[float, float, float, float]) -> str:
+    """
+    Takes: a web mercator (EPSG:3857) map extent [xmin, xmax, ymin, ymax]
+
+    Returns: the Natural Earth scale (e.g. '10m') that cartopy's automatic scaling would draw for the extent
+    """
+    return copy.copy(cfeature.BORDERS.scaler).scale_from_extent(_get_lonlat_extent(extent))
+
+
+@lru_cache(maxsize=None)
+def _get_map_features(scale: str) -> Tuple[cfeature.ShapelyFeature, cfeature.ShapelyFeature]:
+    """
+    Takes: a Natural Earth scale ('10m', '50m', or '110m')
+
+    Returns: border and coastline vector features at that scale. Their geometries are read from disk
+             (and downloaded if necessary) once per process, rather than once per map.
+    """
+    features = []
+    for feature in (cfeature.BORDERS, cfeature.COASTLINE):
+        natural_earth = cfeature.NaturalEarthFeature(feature.category, feature.name, scale)
+        features.append(cfeature.ShapelyFeature(list(natural_earth.geometries()), natural_earth.crs, **feature.kwargs))
+    return tuple(features)
+
+
+@lru_cache(maxsize=1)
+def _get_stock_image() -> np.ndarray:
+    """
+    Returns: cartopy's global stock background image (in PlateCarree, as drawn by GeoAxes.stock_img),
+             read once per process
+    """
+    return plt.imread(Path(cartopy.config['repo_data_dir']) / 'raster' / 'natural_earth'
+                      / '50-natural-earth-1-downsampled.png')
+
+
+def _load_map_sources(scales: Sequence[str] = ()):
+    """
+    Takes: the Natural Earth scales to preload
+
+    Loads the stock background image and border and coastline features into this process's caches,
+    e.g. as a process pool initializer so that workers don't each load them while rendering
+    """
+    _get_stock_image()
+    for scale in scales:
+        _get_map_features(scale)
+
+
+def _draw_basemap(ax, extent: Tuple[float, float, float, float]):
+    """
+    Takes: a cartopy GeoAxes and its web mercator (EPSG:3857) map extent [xmin, xmax, ymin, ymax]
+
+    Draws the stock background, cropped to the extent so only the visible part is reprojected,
+    and vector borders and coastlines at the scale suited to the extent
+    """
+    image = _get_stock_image()
+    lon_min, lon_max, lat_min, lat_max = _get_lonlat_extent(extent)
+    rows, cols = image.shape[:2]
+    col_min = max(0, int(np.floor((lon_min + 180) / 360 * cols)) - 1)
+    col_max = min(cols, int(np.ceil((lon_max + 180) / 360 * cols)) + 1)
+    row_min = max(0, int(np.floor((90 - lat_max) / 180 * rows)) - 1)
+    row_max = min(rows, int(np.ceil((90 - lat_min) / 180 * rows)) + 1)
+    ax.imshow(image[row_min:row_max, col_min:col_max], origin='upper',
+              extent=(col_min / cols * 360 - 180, col_max / cols * 360 - 180,
+                      90 - row_max / rows * 180, 90 - row_min / rows * 180),
+              transform=cartopy.crs.PlateCarree())
+    for feature in _get_map_features(_get_map_scale(extent)):
+        ax.add_feature(feature)
+
+
+def _get_shape_coords(shapefile_path: Union[Path, str], src_crs: str) -> List[np.ndarray]:
+    """
+    Takes: the posix or string path to a shapefile and the string EPSG of its projection
+
+    Returns: a list of (n, 2) web mercator (EPSG:3857) coordinate arrays, one per polygon exterior
+             (or line) of every feature in the shapefile, reprojected in a single vectorized transform
+    """
+    sf = shapefile.Reader(str(shapefile_path))
+    parts = []
+    for feature in sf.shapes():
+        geometry = shape(feature.__geo_interface__)
+        for geom in getattr(geometry, 'geoms', [geometry]):
+            coords = geom.exterior.coords if hasattr(geom, 'exterior') else geom.coords
+            parts.append(np.asarray(coords)[:, :2])
+    sf.close()
+    if not parts:
+        return []
+
+    coords = np.concatenate(parts)
+    project = pyproj.Transformer.from_crs(pyproj.CRS(f'EPSG:{src_crs}'), pyproj.CRS('EPSG:3857'), always_xy=True)
+    x, y = project.transform(coords[:, 0], coords[:, 1])
+    splits = np.cumsum([len(part) for part in parts])[:-1]
+    return np.split(np.column_stack([x, y]), splits)
+
+
+def _get_padded_extent(max_extents: List[Union[float, int]]) -> Tuple[float, float, float, float]:
+    """
+    Takes: web mercator (EPSG:3857) stack extents [xmin, ymin, xmax, ymax]
+
+    Returns: the map extent [xmin, xmax, ymin, ymax] of plot_shape_in_stack, padded by a tenth on each side
+    """
     x_padding = (max_extents[2] - max_extents[0]) / 10
     y_padding = (max_extents[3] - max_extents[1]) / 10
-
-    ax.set_extent(
-        [
-            max_extents[0]-x_padding, # minimum latitude
-            max_extents[2]+x_padding, # max latitude
-            max_extents[1]-y_padding, # min longitude
-            max_extents[3]+y_padding # max longitude
-        ],
-        crs=cartopy.crs.Mercator()
+    return (
+        max_extents[0]-x_padding, # min x
+        max_extents[2]+x_padding, # max x
+        max_extents[1]-y_padding, # min y
+        max_extents[3]+y_padding  # max y
     )
 
+
+def _draw_shape_in_stack(
+    fig: Figure,
+    shapefile_path: Union[Path, str],
+    src_crs: str,
+    max_extents: List[Union[float, int]],
+    common_extents: List[Union[float, int]]):
+    """
+    Draws the basemap, stack extents, and shapefile polygons of plot_shape_in_stack onto fig
+    """
+    extent = _get_padded_extent(max_extents)
+
+    ax = fig.add_subplot(1,1,1, projection=cartopy.crs.Mercator())
+    _draw_basemap(ax, extent)
+    ax.set_extent(extent, crs=cartopy.crs.Mercator())
+
     stack_extents = ax.add_patch(patches.Rectangle(
         (max_extents[0], max_extents[3]),
         max_extents[2] - max_extents[0],
@@ -61,7 +351,6 @@ def plot_shape_in_stack(
 
     extent_handles = [stack_extents]
 
-
     stack_common_extents = ax.add_patch(patches.Rectangle(
         (common_extents[0], common_extents[3]),
         common_extents[2] - common_extents[0], 
@@ -71,27 +360,104 @@ def plot_shape_in_stack(
 
     extent_handles.append(stack_common_extents)
 
-    sf = shapefile.Reader(shapefile_path)
-    feature = sf.shapeRecords()[0]
-    polygon = shape(feature.shape.__geo_interface__)
+    for i, coords in enumerate(_get_shape_coords(shapefile_path, src_crs)):
+        shapefile_extents = ax.add_patch(patches.Polygon(coords,
+                                                      fill=False, edgecolor='red',
+                                                      label='Shapefile extents'))
+        if i == 0:
+            extent_handles.append(shapefile_extents)
+
+    ax.legend(handles=extent_handles)
+
+    gl = ax.gridlines(crs=cartopy.crs.PlateCarree(), draw_labels=True,
+              linewidth=2, color='gray', alpha=0.5, linestyle='--')
+
+
+def plot_shape_in_stack(
+    shapefile_path: Union[Path, str], 
+    src_crs: str, 
+    max_extents: List[Union[float, int]], 
+    common_extents: List[Union[float, int]], 
+    figsize:Optional[Tuple[int]]=None):
+    
+    """
+    Generates a basemap plot showing the maximum and common geographic extents covered by a data stack of geotiffs, and the location of the Polygons within
+    those extents (loaded from a shapefile).
+    
+    Args:
+        shapefile_path: the posix or string path to a shapefile containing Polygons in the same projection as your data stack
+        src_crs:        The string EPSG of the data stack
+        extents:        web mercator (EPSG: 3857) max raster extents of entire stack [xmin, ymin, xmax, ymax]
+                            (guaranteed to contain data in at least one raster)
+        common_extents: web mercator (EPSG: 3857) raster extents common to entire stack [xmin, ymin, xmax, ymax]
+                            (guaranteed to contain data in all rasters)
+        figsize: a tuple containing the figure size of the output plot in the format (x_size, y_size)     
+    """
+    
+    fig = plt.figure(figsize=figsize)
+    _draw_shape_in_stack(fig, shapefile_path, src_crs, max_extents, common_extents)
+    plt.show()
 
-    utm_crs = pyproj.CRS(f'EPSG:{src_crs}')
-    web_crs = pyproj.CRS('EPSG:3857')
 
-    project = pyproj.Transformer.from_crs(utm_crs, web_crs, always_xy=True).transform
-    web_sf = transform(project, polygon)
+def render_shape_in_stack(
+    shapefile_path: Union[Path, str],
+    src_crs: str,
+    max_extents: List[Union[float, int]],
+    common_extents: List[Union[float, int]],
+    figsize: Optional[Tuple[int]] = None,
+    dpi: Optional[int] = 100,
+    output: Optional[Union[Path, str]] = None) -> Union[bytes, Path]:
+    """
+    Renders the plot_shape_in_stack map headlessly with the Agg backend, without touching pyplot's
+    global state or calling plt.show. The basemap's background image and border and coastline
+    geometries are loaded once per process and reused by every map.
 
-    x, y = web_sf.exterior.coords.xy
+    Args:
+        shapefile_path: the posix or string path to a shapefile containing Polygons in the same projection as your data stack
+        src_crs:        The string EPSG of the data stack
+        max_extents:    web mercator (EPSG: 3857) max raster extents of entire stack [xmin, ymin, xmax, ymax]
+        common_extents: web mercator (EPSG: 3857) raster extents common to entire stack [xmin, ymin, xmax, ymax]
+        figsize: a tuple containing the figure size of the output plot in the format (x_size, y_size)
+        dpi: the resolution of the rendered PNG
+        output: optional posix or string path to which to write the PNG
 
-    shapefile_extents = ax.add_patch(patches.Polygon(list(zip(x,y)), 
-                                                  fill=False, edgecolor='red',
-                                                  label='Shapefile extents'))
+    Returns: the PNG's bytes, or its path if output was passed
+    """
+    fig = Figure(figsize=figsize or tuple(plt.rcParams['figure.figsize']), dpi=dpi)
+    FigureCanvasAgg(fig)
+    _draw_shape_in_stack(fig, shapefile_path, src_crs, max_extents, common_extents)
+    if output:
+        fig.savefig(output, format='png')
+        return Path(output)
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format='png')
+    return buffer.getvalue()
 
-    extent_handles.append(shapefile_extents)
 
-    ax.legend(handles=extent_handles)
+def _render_shape_in_stack_kwargs(kwargs: Dict) -> Union[bytes, Path]:
+    """
+    Takes: a dictionary of render_shape_in_stack keyword arguments
 
-    gl = ax.gridlines(crs=cartopy.crs.PlateCarree(), draw_labels=True,
-              linewidth=2, color='gray', alpha=0.5, linestyle='--')
+    Returns: the result of render_shape_in_stack
+    """
+    return render_shape_in_stack(**kwargs)
 
-    plt.show()
\ No newline at end of file
+
+def render_shapes_in_stacks(previews: List[Dict], max_workers: Optional[int] = None) -> List[Union[bytes, Path]]:
+    """
+    Renders many plot_shape_in_stack maps in parallel across a process pool (e.g. for batch reports).
+    The basemap sources are loaded in the calling process first, so a failure to load them (e.g. when
+    Natural Earth data can't be downloaded) raises its own error, and then once by each worker when it starts.
+
+    Args:
+        previews: a list of dictionaries of render_shape_in_stack keyword arguments, one per map
+        max_workers: number of worker processes (defaults to the number of CPUs)
+
+    Returns: a list of PNG bytes (or output paths), in the order of previews
+    """
+    scales = sorted({_get_map_scale(_get_padded_extent(preview['max_extents'])) for preview in previews})
+    # load (and download if necessary) the sources here first, so failures raise their own errors
+    # rather than breaking the pool, and workers only read the sources from local disk
+    _load_map_sources(scales)
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_load_map_sources, initargs=(scales,)) as pool:
+        return list(pool.map(_render_shape_in_stack_kwargs, previews))
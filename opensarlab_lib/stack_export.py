@@ -0,0 +1,153 @@
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+from osgeo import gdal
+
+from .custom_exceptions import ProjectionError
+from .gdal_wrap import _get_aligned_stack_grid, _get_valid_data
+from .product_name_parse import date_from_product_name, get_polarity_from_path
+
+
+class _GdalBand:
+    """
+    A lazily read, array-like view of a raster's first band for dask.array.from_array.
+    Each slice opens the raster and reads only the requested window, as float32 with
+    nodata (0 if unset) set to NaN.
+    """
+
+    def __init__(self, tif: str, shape: Tuple[int, int]):
+        self.tif = tif
+        self.shape = shape
+        self.dtype = np.dtype(np.float32)
+        self.ndim = 2
+
+    def __getitem__(self, key: Tuple[slice, slice]) -> np.ndarray:
+        rows, cols = (k.indices(size)[:2] for k, size in zip(key, self.shape))
+        raster = gdal.Open(self.tif)
+        if raster is None:
+            raise FileNotFoundError(self.tif)
+        band = raster.GetRasterBand(1)
+        block = band.ReadAsArray(cols[0], rows[0], cols[1] - cols[0], rows[1] - rows[0])
+        valid = _get_valid_data(block, band.GetNoDataValue())
+        block = block.astype(np.float32)
+        block[~valid] = np.nan
+        return block
+
+
+def _group_acquisitions(tifs: List[Union[Path, str]]) -> Dict[pd.Timestamp, Dict[str, str]]:
+    """
+    Takes: a list of string or posix paths to HyP3 products
+
+    Raises a ValueError if two geotiffs share an acquisition time and polarization
+
+    Returns: a dictionary of acquisition times to dictionaries of polarizations to string paths
+    """
+    acquisitions = {}
+    for tif in tifs:
+        dt = date_from_product_name(tif)
+        if dt is None:
+            raise ValueError(f"Could not parse an acquisition date from {tif}")
+        polarity = get_polarity_from_path(tif)
+        polarity = polarity.upper() if polarity else 'band'
+        acquisition = acquisitions.setdefault(pd.to_datetime(dt, format='%Y%m%dT%H%M%S'), {})
+        if polarity in acquisition:
+            raise ValueError(f"{acquisition[polarity]} and {tif} are both {polarity} acquisitions from {dt}")
+        acquisition[polarity] = str(tif)
+    return acquisitions
+
+
+def export_stack_to_zarr(tifs: List[Union[Path, str]],
+                         store: Union[Path, str],
+                         chunks: Optional[Tuple[int, int, int]] = (64, 256, 256),
+                         append: Optional[bool] = False,
+                         max_workers: Optional[int] = None) -> Path:
+    """
+    Writes a pixel-aligned stack of HyP3 geotiffs (see gdal_wrap.normalize_stack_projection)
+    to a single chunked, compressed Zarr store, so that later analyses read a handful of
+    chunks instead of opening and decoding every geotiff.
+
+    The store holds one (time, y, x) float32 variable per polarization (e.g. 'VV', 'VH'),
+    with time coordinates parsed by date_from_product_name, pixel-center y and x coordinates,
+    and the CRS stored in a CF-style 'spatial_ref' grid mapping variable. Nodata is written as NaN.
+    Chunks are read and written in parallel with dask's threaded scheduler.
+
+    Requires the optional xarray, dask, and zarr packages.
+
+    tifs: list of string or posix paths to a pixel-aligned stack of HyP3 geotiffs
+    store: string or posix path to the Zarr store to create or append to
+    chunks: (time, y, x) chunk shape. A long time chunk keeps a pixel's time series in few chunks.
+            Ignored when appending, in favor of the existing store's chunks.
+    append: append acquisitions newer than those already in an existing store
+    max_workers: number of dask threads (defaults to the number of CPUs)
+
+    returns: the path to the Zarr store
+    """
+    try:
+        import dask
+        import dask.array as da
+        import xarray as xr
+    except ModuleNotFoundError:
+        raise ModuleNotFoundError("export_stack_to_zarr requires xarray, dask, and zarr. "
+                                  "Install them with: python -m pip install opensarlab_lib[zarr]")
+
+    geotransform, projection, xsize, ysize, _ = _get_aligned_stack_grid(tifs)
+    x = geotransform[0] + (np.arange(xsize) + 0.5) * geotransform[1]
+    y = geotransform[3] + (np.arange(ysize) + 0.5) * geotransform[5]
+    acquisitions = _group_acquisitions(tifs)
+    times = sorted(acquisitions)
+    polarizations = sorted({pol for acquisition in acquisitions.values() for pol in acquisition})
+
+    store = Path(store)
+    first_time_chunk = chunks[0]
+    appending = append and store.exists()
+    if appending:
+        with xr.open_zarr(store) as existing:
+            if not np.allclose(existing.x, x) or not np.allclose(existing.y, y):
+                raise ValueError(f"The stack is not pixel-aligned with {store}")
+            if existing.spatial_ref.attrs.get('crs_wkt') != projection:
+                raise ProjectionError(f"The stack's projection differs from that of {store}")
+            if set(existing.data_vars) != set(polarizations):
+                raise ValueError(f"{store} holds {sorted(existing.data_vars)}, not {polarizations}")
+            # chunk the new acquisitions like the store, whatever chunks were passed
+            chunks = tuple(existing[polarizations[0]].encoding['chunks'])
+            existing_times = set(pd.to_datetime(existing.time.values))
+            last_time = max(existing_times)
+            times = [t for t in times if t not in existing_times]
+            if any(t < last_time for t in times):
+                raise ValueError(f"Only acquisitions after {last_time} can be appended to {store}")
+            # fill the store's partial last time chunk first so dask chunks stay aligned with zarr chunks
+            first_time_chunk = chunks[0] - existing.sizes['time'] % chunks[0]
+        if not times:
+            print(f"No new acquisitions to append to {store}")
+            return store
+
+    time_chunks = []
+    remaining = len(times)
+    while remaining > 0:
+        time_chunks.append(min(first_time_chunk if not time_chunks else chunks[0], remaining))
+        remaining -= time_chunks[-1]
+
+    data_vars = {}
+    for pol in polarizations:
+        layers = [da.from_array(_GdalBand(acquisitions[t][pol], (ysize, xsize)), chunks=chunks[1:])
+                  if pol in acquisitions[t]
+                  else da.full((ysize, xsize), np.nan, dtype=np.float32, chunks=chunks[1:])
+                  for t in times]
+        stack = da.stack(layers).rechunk((tuple(time_chunks), chunks[1], chunks[2]))
+        data_vars[pol] = (('time', 'y', 'x'), stack, {'grid_mapping': 'spatial_ref'})
+
+    spatial_ref = ((), 0, {
+        'crs_wkt': projection,
+        'spatial_ref': projection,
+        'GeoTransform': ' '.join(str(g) for g in geotransform)
+    })
+    ds = xr.Dataset(data_vars, coords={'time': times, 'y': y, 'x': x, 'spatial_ref': spatial_ref})
+
+    with dask.config.set(scheduler='threads', num_workers=max_workers):
+        if appending:
+            ds.drop_vars(['y', 'x', 'spatial_ref']).to_zarr(store, append_dim='time')
+        else:
+            ds.to_zarr(store, mode='w-')
+    return store
@@ -0,0 +1,211 @@
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+import math
+import os
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from osgeo import gdal
+
+from .gdal_wrap import _get_aligned_stack_grid, _get_valid_data, _open_dataset, close_datasets, read_window
+from .tile_cache import TileCache
+
+BASIC_STATS = ('mean', 'std', 'min', 'max', 'cv', 'count')
+
+
+def _get_stack_windows(xsize: int, ysize: int,
+                       native_block: Tuple[int, int],
+                       block_size: int) -> Iterator[Tuple[int, int, int, int]]:
+    """
+    Takes: raster dimensions, the raster's native (x, y) block size, and a target block edge length
+
+    Yields: (xoff, yoff, xsize, ysize) windows that are whole multiples of the native block size,
+            so no tile is decoded by more than one window
+    """
+    block_x = min(xsize, max(native_block[0], block_size // native_block[0] * native_block[0]))
+    block_y = min(ysize, max(native_block[1], block_size // native_block[1] * native_block[1]))
+    if native_block[0] >= xsize:
+        # striped rasters: read full-width strips of about block_size**2 pixels
+        block_y = min(ysize, max(native_block[1], block_size ** 2 // xsize // native_block[1] * native_block[1]))
+    for yoff in range(0, ysize, block_y):
+        for xoff in range(0, xsize, block_x):
+            yield xoff, yoff, min(block_x, xsize - xoff), min(block_y, ysize - yoff)
+
+
+def _compute_block_stats(tifs: Sequence[str],
+                         nodatas: Sequence[Union[float, int, None]],
+                         window: Tuple[int, int, int, int],
+                         stats: Sequence[str],
+                         percentiles: Sequence[float],
+                         cache: Optional[TileCache] = None) -> Tuple[Tuple[int, int, int, int], Dict[str, np.ndarray]]:
+    """
+    Takes: a list of string paths to an aligned stack, their nodata values, a block window,
+    the statistics to compute, and an optional TileCache through which to read the stack
+
+    Returns: the window and a dictionary of statistic names to float32 arrays for that window
+
+    Mean, standard deviation, min, max, and count are accumulated one date at a time with
+    Welford's algorithm, so only the percentiles require the block column for every date in memory.
+    """
+    xoff, yoff, xsize, ysize = window
+    count = np.zeros((ysize, xsize), dtype=np.uint32)
+    mean = np.zeros((ysize, xsize), dtype=np.float64)
+    m2 = np.zeros((ysize, xsize), dtype=np.float64)
+    minimum = np.full((ysize, xsize), np.inf)
+    maximum = np.full((ysize, xsize), -np.inf)
+    column = np.full((len(tifs), ysize, xsize), np.nan, dtype=np.float32) if percentiles else None
+
+    for i, (tif, nodata) in enumerate(zip(tifs, nodatas)):
+        block = read_window(tif, xoff, yoff, xsize, ysize, cache=cache)
+        valid = _get_valid_data(block, nodata)
+        block = block.astype(np.float64)
+
+        count += valid
+        delta = np.where(valid, block - mean, 0.0)
+        mean += np.divide(delta, count, out=np.zeros_like(delta), where=valid)
+        m2 += np.where(valid, delta * (block - mean), 0.0)
+        np.fmin(minimum, np.where(valid, block, np.inf), out=minimum)
+        np.fmax(maximum, np.where(valid, block, -np.inf), out=maximum)
+        if column is not None:
+            column[i][valid] = block[valid]
+
+    empty = count == 0
+    results = {}
+    with np.errstate(divide='ignore', invalid='ignore'):
+        std = np.sqrt(m2 / count)
+        for stat in stats:
+            if stat == 'mean':
+                results[stat] = mean
+            elif stat == 'std':
+                results[stat] = std
+            elif stat == 'min':
+                results[stat] = minimum
+            elif stat == 'max':
+                results[stat] = maximum
+            elif stat == 'cv':
+                results[stat] = std / mean
+            elif stat == 'count':
+                results[stat] = count
+    if column is not None:
+        for q, values in zip(percentiles, np.nanpercentile(column, percentiles, axis=0)):
+            results[f"p{q:g}"] = values
+
+    for stat, values in results.items():
+        values = values.astype(np.float32)
+        if stat != 'count':
+            values[empty] = np.nan
+        results[stat] = values
+    return window, results
+
+
+def compute_temporal_stats(tifs: List[Union[Path, str]],
+                           output_dir: Union[Path, str],
+                           stats: Optional[Sequence[str]] = BASIC_STATS,
+                           percentiles: Optional[Sequence[float]] = None,
+                           prefix: Optional[str] = 'temporal',
+                           block_size: Optional[int] = 512,
+                           max_workers: Optional[int] = None,
+                           use_processes: Optional[bool] = False,
+                           cache: Optional[TileCache] = None,
+                           max_percentile_bytes: Optional[int] = 1024**3) -> Dict[str, Path]:
+    """
+    Computes per-pixel temporal statistics over a pixel-aligned stack of geotiffs
+    (see gdal_wrap.normalize_stack_projection), one spatial block at a time.
+
+    Each block is read from every date, reduced with vectorized numpy, and written out before
+    the next blocks are read, so memory is bounded by the block size rather than the stack size.
+    Blocks are whole multiples of the geotiffs' native tiling and are processed in parallel.
+    Workers read through gdal_wrap's per-process pool of open datasets, which is bounded by the
+    open file limit however many workers and dates there are.
+
+    Percentiles need every date of a block in memory at once, so when they are requested, blocks
+    shrink to keep those columns within max_percentile_bytes across all workers. A ValueError is
+    raised if even a single native block of every date would not fit, which happens for stacks of
+    more than max_percentile_bytes / (4 * max_workers * native block pixels) dates.
+
+    Nodata (0 if unset) and NaN pixels are excluded. 'std' is the population standard deviation
+    and 'cv' (the coefficient of variation) is std / mean.
+
+    tifs: list of string or posix paths to a pixel-aligned stack of geotiffs
+    output_dir: directory in which to write the statistics geotiffs
+    stats: any of 'mean', 'std', 'min', 'max', 'cv', and 'count'
+    percentiles: optional percentiles (0-100) to compute, written as e.g. 'p5', 'p95'
+    prefix: filename prefix for the output geotiffs
+    block_size: approximate edge length in pixels of the blocks processed by each worker
+    max_workers: number of workers (defaults to the number of CPUs)
+    use_processes: use a process pool instead of a thread pool
+    cache: an optional TileCache through which to read the stack (not supported with use_processes)
+    max_percentile_bytes: memory budget for the per-block date columns from which percentiles are computed
+
+    returns: a dictionary of statistic names to paths of the output geotiffs
+    """
+    tifs = [str(tif) for tif in tifs]
+    if not tifs:
+        raise ValueError("No geotiffs passed")
+    unknown = set(stats) - set(BASIC_STATS)
+    if unknown:
+        raise ValueError(f"Unknown statistics: {unknown}. Choose from {BASIC_STATS}")
+    if use_processes and cache is not None:
+        raise ValueError("A TileCache can only be shared by threads, not processes")
+    percentiles = list(percentiles) if percentiles else []
+    geotransform, projection, xsize, ysize, native_block = _get_aligned_stack_grid(tifs)
+    max_workers = max_workers or os.cpu_count() or 1
+    if percentiles:
+        column_pixels = max_percentile_bytes // (4 * len(tifs) * max_workers)
+        native_pixels = min(native_block[0], xsize) * min(native_block[1], ysize)
+        if native_pixels > column_pixels:
+            raise ValueError(f"Percentiles over {len(tifs)} dates need at least "
+                             f"{4 * len(tifs) * max_workers * native_pixels} bytes. "
+                             f"Raise max_percentile_bytes, lower max_workers, or pass fewer dates.")
+        block_size = min(block_size, math.isqrt(column_pixels))
+    nodatas = []
+    for tif in tifs:
+        with _open_dataset(tif) as raster:
+            nodatas.append(raster.GetRasterBand(1).GetNoDataValue())
+
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    driver = gdal.GetDriverByName('GTiff')
+    outputs = {}
+    paths = {}
+    for stat in list(stats) + [f"p{q:g}" for q in percentiles]:
+        paths[stat] = output_dir / f"{prefix}_{stat}.tif"
+        outputs[stat] = driver.Create(str(paths[stat]), xsize, ysize, 1, gdal.GDT_Float32,
+                                      options=['COMPRESS=DEFLATE', 'TILED=YES', 'BIGTIFF=IF_SAFER'])
+        outputs[stat].SetGeoTransform(geotransform)
+        outputs[stat].SetProjection(projection)
+        if stat != 'count':
+            outputs[stat].GetRasterBand(1).SetNoDataValue(np.nan)
+
+    executor = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+    windows = _get_stack_windows(xsize, ysize, native_block, block_size)
+    try:
+        with executor(max_workers=max_workers) as pool:
+            # keep a bounded number of blocks in flight so finished blocks don't pile up in memory
+            pending = set()
+            for window in windows:
+                pending.add(pool.submit(_compute_block_stats, tifs, nodatas, window, list(stats), percentiles, cache))
+                if len(pending) >= 2 * max_workers:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    _write_block_stats(outputs, done)
+            _write_block_stats(outputs, pending)
+    finally:
+        close_datasets(tifs)
+
+    for stat in outputs:
+        outputs[stat].FlushCache()
+        outputs[stat] = None
+    return paths
+
+
+def _write_block_stats(outputs: Dict[str, gdal.Dataset], futures: set):
+    """
+    Takes: a dictionary of statistic names to output gdal.Datasets and a set of
+    futures returned by _compute_block_stats
+
+    Writes each finished block to its output datasets
+    """
+    for future in futures:
+        (xoff, yoff, _, _), results = future.result()
+        for stat, values in results.items():
+            outputs[stat].GetRasterBand(1).WriteArray(values, xoff, yoff)
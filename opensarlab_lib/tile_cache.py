@@ -0,0 +1,170 @@
+from collections import OrderedDict
+import hashlib
+import os
+from pathlib import Path
+import tempfile
+import threading
+from typing import Dict, Optional, Tuple, Union
+
+import numpy as np
+
+from .gdal_wrap import _get_file_identity, _open_dataset
+
+TILE_SUFFIX = '.tile.npy'
+
+
+class TileCache:
+    """
+    A read-through cache of decoded raster blocks on fast local storage.
+
+    Blocks are decoded once from their (e.g. network hosted, DEFLATE compressed) source,
+    saved to local '*.tile.npy' files, and memory-mapped on later reads. Blocks are keyed by
+    the source file's identity (resolved path, size, and modification time), band, and block
+    index, and sources are reopened when they change, so a rewritten source is never served
+    stale blocks. The least recently used blocks are evicted once the cache exceeds max_bytes.
+    Only '*.tile.npy' files are ever adopted or deleted, so other files in cache_dir are left alone.
+
+    Pass a TileCache as the cache argument of gdal_wrap.read_window, gdal_wrap.write_validity_masks,
+    temporal_stats.compute_temporal_stats, or plot.get_stack_histogram, or read through it directly.
+
+    Usage:
+    cache = TileCache('/tmp/tile_cache', max_bytes=4 * 1024**3)
+    window = cache.read_window(tif, xoff, yoff, xsize, ysize)
+    print(cache.hits, cache.misses)
+    """
+
+    def __init__(self, cache_dir: Optional[Union[Path, str]] = None,
+                 max_bytes: Optional[int] = 2 * 1024**3):
+        """
+        Args:
+            cache_dir: local directory in which to store decoded blocks (defaults to a temporary directory).
+                       Blocks already in cache_dir are reused.
+            max_bytes: the cache's byte budget
+        """
+        self.cache_dir = Path(cache_dir) if cache_dir else Path(tempfile.mkdtemp(prefix='tile_cache_'))
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._layouts = {}
+        self._blocks = OrderedDict()
+        self._bytes = 0
+        for block_path in sorted(self.cache_dir.glob(f"*{TILE_SUFFIX}"), key=lambda p: p.stat().st_mtime):
+            self._blocks[block_path.name] = block_path.stat().st_size
+            self._bytes += block_path.stat().st_size
+        self._evict()
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Returns: the number of bytes currently cached
+        """
+        return self._bytes
+
+    def _evict(self):
+        """
+        Deletes the least recently used blocks until the cache is within its byte budget
+        """
+        with self._lock:
+            while self._bytes > self.max_bytes and self._blocks:
+                name, size = self._blocks.popitem(last=False)
+                self._bytes -= size
+                (self.cache_dir / name).unlink(missing_ok=True)
+
+    def _get_layout(self, tif: str, band: int) -> Tuple[str, int, int, int, int]:
+        """
+        Takes: a string path to a raster and a band number
+
+        Returns: the raster band's identity key, x size, y size, and native block x and y sizes
+        """
+        identity = f"{_get_file_identity(tif)}:{band}"
+        if identity not in self._layouts:
+            with _open_dataset(tif) as raster:
+                raster_band = raster.GetRasterBand(band)
+                self._layouts[identity] = (raster_band.XSize, raster_band.YSize, *raster_band.GetBlockSize())
+        return (identity, *self._layouts[identity])
+
+    def read_block(self, tif: Union[Path, str], xblock: int, yblock: int, band: Optional[int] = 1) -> np.ndarray:
+        """
+        Takes: a string or posix path to a raster, a block's x and y indices, and an optional band number
+
+        Returns: the decoded block, from the cache if present (as a read-only memory-mapped array)
+        """
+        tif = str(tif)
+        identity, xsize, ysize, block_x, block_y = self._get_layout(tif, band)
+        name = f"{hashlib.sha1(f'{identity}:{xblock}:{yblock}'.encode()).hexdigest()}{TILE_SUFFIX}"
+        block_path = self.cache_dir / name
+
+        with self._lock:
+            cached = name in self._blocks
+            if cached:
+                self._blocks.move_to_end(name)
+                self.hits += 1
+            else:
+                self.misses += 1
+        if cached:
+            try:
+                return np.load(block_path, mmap_mode='r')
+            except FileNotFoundError:
+                # evicted by another thread since the lookup
+                pass
+
+        xoff, yoff = xblock * block_x, yblock * block_y
+        with _open_dataset(tif) as raster:
+            block = raster.GetRasterBand(band).ReadAsArray(
+                xoff, yoff, min(block_x, xsize - xoff), min(block_y, ysize - yoff))
+        tmp_path = self.cache_dir / f"{name}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.save(f, block)
+        os.replace(tmp_path, block_path)
+        with self._lock:
+            if name not in self._blocks:
+                self._blocks[name] = block_path.stat().st_size
+                self._bytes += self._blocks[name]
+        self._evict()
+        return block
+
+    def read_window(self, tif: Union[Path, str], xoff: int, yoff: int, xsize: int, ysize: int,
+                    band: Optional[int] = 1) -> np.ndarray:
+        """
+        Takes: a string or posix path to a raster, a pixel window, and an optional band number
+
+        Returns: the window's data, assembled from cached blocks
+        """
+        tif = str(tif)
+        _, raster_x, raster_y, block_x, block_y = self._get_layout(tif, band)
+        if xoff < 0 or yoff < 0 or xoff + xsize > raster_x or yoff + ysize > raster_y:
+            raise ValueError(f"Window ({xoff}, {yoff}, {xsize}, {ysize}) is outside of {tif}")
+
+        window = None
+        for yblock in range(yoff // block_y, (yoff + ysize - 1) // block_y + 1):
+            for xblock in range(xoff // block_x, (xoff + xsize - 1) // block_x + 1):
+                block = self.read_block(tif, xblock, yblock, band)
+                if window is None:
+                    window = np.empty((ysize, xsize), dtype=block.dtype)
+                x0, y0 = xblock * block_x, yblock * block_y
+                x1, y1 = max(xoff, x0), max(yoff, y0)
+                x2, y2 = min(xoff + xsize, x0 + block.shape[1]), min(yoff + ysize, y0 + block.shape[0])
+                window[y1 - yoff:y2 - yoff, x1 - xoff:x2 - xoff] = block[y1 - y0:y2 - y0, x1 - x0:x2 - x0]
+        return window
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns: a dictionary of the cache's hits, misses, cached blocks, and cached bytes
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'blocks': len(self._blocks), 'bytes': self._bytes}
+
+    def clear(self):
+        """
+        Deletes every cached block and resets the hit and miss counters
+        """
+        with self._lock:
+            for name in self._blocks:
+                (self.cache_dir / name).unlink(missing_ok=True)
+            self._blocks.clear()
+            self._bytes = 0
+            self.hits = 0
+            self.misses = 0
@@ -1,5 +1,7 @@
+import asyncio
 from datetime import datetime
-from typing import List, Set, Dict, Union, Optional
+import time
+from typing import Callable, List, Set, Dict, Union, Optional
 
 import pandas as pd
 
@@ -27,12 +29,110 @@ def gui_date_picker(dates: list) -> widgets.SelectionRangeSlider:
     return (selection_range_slider)
 
 
+def gui_acquisition_date_picker(dates: Union[List[str], Dict[str, Union[int, Set, List]]],
+                                bin_freq: Optional[str] = None) -> widgets.SelectionRangeSlider:
+    """
+    Takes: a list of string acquisition dates ('%Y%m%d', repeated once per job) or a dictionary of
+           string acquisition dates to job counts or job containers (see hyp3_wrap.get_jobs_by_date),
+           and an optional pandas frequency string (e.g. 'W', 'M', 'Q') with which to bin the dates
+
+    Returns: a SelectionRangeSlider with one option per acquisition date (or per bin containing
+             acquisitions), each labeled with its job count
+    """
+    if isinstance(dates, dict):
+        counts = pd.Series({d: c if isinstance(c, int) else len(c) for d, c in dates.items()})
+    else:
+        counts = pd.Series(dates).value_counts()
+    counts.index = pd.to_datetime(counts.index, format='%Y%m%d')
+
+    if bin_freq:
+        counts = counts.groupby(counts.index.to_period(bin_freq)).sum().sort_index()
+        options = [(f" {period.start_time.strftime('%m/%d/%Y')} ({count}) ", period)
+                   for period, count in counts.items()]
+    else:
+        counts = counts.sort_index()
+        options = [(date.strftime(' %m/%d/%Y ') + f"({count}) ", date) for date, count in counts.items()]
+    index = (0, len(options) - 1)
+
+    return widgets.SelectionRangeSlider(
+        options=options,
+        index=index,
+        description='Dates',
+        orientation='horizontal',
+        layout={'width': '500px'})
+
+
+class _Throttle:
+    """
+    Calls a callback at most once per interval, always with the most recent value.
+    Calls arriving within the interval are coalesced into a single trailing call.
+
+    The trailing call is scheduled on the asyncio event loop of the thread that made the call
+    (the kernel's IOLoop in Jupyter), so every call runs on that thread, output reaches the
+    cell's Output widget, and calls never overlap. Calls made where no event loop is running
+    (e.g. from a script or another thread) are not throttled, and call the callback immediately.
+    """
+
+    def __init__(self, callback: Callable, interval: float):
+        self.callback = callback
+        self.interval = interval
+        self._last_call = 0.0
+        self._pending = None
+        self._handle = None
+
+    def __call__(self, value):
+        self._pending = value
+        if self._handle is not None:
+            return
+        wait = self._last_call + self.interval - time.monotonic()
+        if wait > 0:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                # no event loop would ever run a trailing call, so call back now rather than drop the value
+                loop = None
+            if loop is not None:
+                self._handle = loop.call_later(wait, self._fire)
+                return
+        self._last_call = time.monotonic()
+        self.callback(value)
+
+    def _fire(self):
+        self._handle = None
+        self._last_call = time.monotonic()
+        self.callback(self._pending)
+
+
+def observe_throttled(widget: widgets.ValueWidget, callback: Callable,
+                      max_calls_per_second: Optional[float] = 2) -> Callable:
+    """
+    Takes: a widget, a callback accepting the widget's value, and the maximum
+           number of times per second the callback may be called
+
+    Observes the widget's value, calling callback at most max_calls_per_second times per second.
+    The final value of a burst of changes (e.g. from dragging a slider) is always passed to callback,
+    from the kernel's event loop, once any running cell has finished executing. Changes made where no
+    event loop is running (e.g. from a script) are passed to callback immediately, without throttling.
+
+    Returns: the registered handler, which may be passed to widget.unobserve(handler, names='value')
+    """
+    throttle = _Throttle(callback, 1 / max_calls_per_second)
+
+    def handler(change: dict):
+        throttle(change['new'])
+
+    widget.observe(handler, names='value')
+    return handler
+
+
 def get_slider_vals(selection_range_slider: widgets.SelectionRangeSlider) -> List[datetime.date]:
     """
     Takes: widgets.SelectionRangeSlider of dates
     Returns: a list containing the min and max selected dates from the SelectionRangeSlider
     """
     [a, b] = list(selection_range_slider.value)
+    if isinstance(a, pd.Period):
+        a, b = a.start_time, b.end_time
     slider_min = a.to_pydatetime()
     slider_max = b.to_pydatetime()
     return [slider_min, slider_max]
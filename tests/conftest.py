@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def make_tif():
+    """
+    Returns a function that writes a tiled, single band float32 GeoTIFF and returns its string path.
+    Any /vsimem/ files it creates are unlinked after the test.
+    """
+    gdal = pytest.importorskip('osgeo.gdal')
+    osr = pytest.importorskip('osgeo.osr')
+    created = []
+
+    def _make_tif(path, data, ulx=500000.0, uly=4000000.0, res=30.0, epsg=32610, nodata=None, block_size=16):
+        path = str(path)
+        raster = gdal.GetDriverByName('GTiff').Create(
+            path, data.shape[1], data.shape[0], 1, gdal.GDT_Float32,
+            options=['TILED=YES', f"BLOCKXSIZE={block_size}", f"BLOCKYSIZE={block_size}"])
+        raster.SetGeoTransform([ulx, res, 0.0, uly, 0.0, -res])
+        srs = osr.SpatialReference()
+        srs.ImportFromEPSG(epsg)
+        raster.SetProjection(srs.ExportToWkt())
+        band = raster.GetRasterBand(1)
+        if nodata is not None:
+            band.SetNoDataValue(nodata)
+        band.WriteArray(np.asarray(data, dtype=np.float32))
+        raster.FlushCache()
+        raster = None
+        created.append(path)
+        return path
+
+    yield _make_tif
+    for path in created:
+        if path.startswith('/vsimem/'):
+            gdal.Unlink(path)
@@ -0,0 +1,195 @@
+import os
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+gdal = pytest.importorskip('osgeo.gdal')
+
+import opensarlab_lib.gdal_wrap as gdal_wrap
+
+
+def test_validity_mask_round_trip(tmp_path, make_tif):
+    data = np.ones((20, 37), dtype=np.float32)
+    data[0, :5] = 0
+    data[3, 7] = np.nan
+    tif = make_tif(tmp_path / 'a.tif', data)
+    empty = make_tif(tmp_path / 'empty.tif', np.zeros((20, 37)))
+
+    masks = gdal_wrap.write_validity_masks([tif, empty])
+    assert masks == [Path(f"{tif}.valid.npy"), Path(f"{empty}.valid.npy")]
+    assert np.load(masks[0]).shape == (20, 5)
+
+    expected = np.ones((20, 37), dtype=bool)
+    expected[0, :5] = False
+    expected[3, 7] = False
+    assert np.array_equal(gdal_wrap.read_validity_mask(tif), expected)
+    assert gdal_wrap.get_empty_tifs([tif, empty]) == [Path(empty)]
+
+
+def test_coverage_count(tmp_path, make_tif):
+    a = make_tif(tmp_path / 'a.tif', np.ones((10, 10)))
+    b = make_tif(tmp_path / 'b.tif', np.ones((10, 10)), ulx=500150.0)
+    gdal_wrap.write_validity_masks([a, b])
+
+    count = gdal_wrap.get_coverage_count([a, b], output=tmp_path / 'count.tif')
+    expected = np.ones((10, 15), dtype=np.uint16)
+    expected[:, 5:10] = 2
+    assert count.dtype == np.uint16
+    assert np.array_equal(count, expected)
+    assert np.array_equal(gdal.Open(str(tmp_path / 'count.tif')).ReadAsArray(), expected)
+
+    extents = gdal_wrap.get_valid_coverage_extents([a, b])
+    assert extents == [500150.0, 3999700.0, 500300.0, 4000000.0]
+    assert all(type(e) is float for e in extents)
+    assert gdal_wrap.get_valid_coverage_extents([a, b], min_count=1) == [500000.0, 3999700.0, 500450.0, 4000000.0]
+
+
+def test_coverage_count_off_grid(tmp_path, make_tif):
+    a = make_tif(tmp_path / 'a.tif', np.ones((10, 10)))
+    b = make_tif(tmp_path / 'b.tif', np.ones((10, 10)), ulx=500015.0)
+    gdal_wrap.write_validity_masks([a, b])
+    with pytest.raises(ValueError, match='pixel grid'):
+        gdal_wrap.get_coverage_count([a, b])
+
+
+def _two_zone_stack(tmp_path, make_tif):
+    pyproj = pytest.importorskip('pyproj')
+    to_zone_11 = pyproj.Transformer.from_crs('EPSG:32610', 'EPSG:32611', always_xy=True)
+    ulx, uly = to_zone_11.transform(750600, 4440000)
+    data = np.arange(1, 1601, dtype=np.float32).reshape(40, 40)
+    return [
+        make_tif(tmp_path / 'a.tif', data, ulx=750000.0, uly=4440000.0),
+        make_tif(tmp_path / 'b.tif', data, ulx=750300.0, uly=4439700.0),
+        make_tif(tmp_path / 'c.tif', data, ulx=round(ulx / 30) * 30, uly=round(uly / 30) * 30, epsg=32611)
+    ]
+
+
+def test_get_max_extents_mixed_projections(tmp_path, make_tif):
+    with pytest.raises(gdal_wrap.ProjectionError):
+        gdal_wrap.get_max_extents(_two_zone_stack(tmp_path, make_tif))
+
+
+@pytest.mark.parametrize('extents', ['max', 'common'])
+def test_normalize_stack_projection(tmp_path, make_tif, extents):
+    tifs = _two_zone_stack(tmp_path, make_tif)
+    normalized = gdal_wrap.normalize_stack_projection(tifs, output_dir=tmp_path / 'out', extents=extents)
+
+    assert len(normalized) == 3
+    assert all(gdal_wrap.get_projection(tif) == '32610' for tif in normalized)
+    geotransform, _, xsize, ysize, _ = gdal_wrap._get_aligned_stack_grid(normalized)
+    assert geotransform[0] % 30 == 0 and geotransform[3] % 30 == 0
+    if extents == 'max':
+        assert xsize > 40 and ysize > 40
+    else:
+        assert xsize < 40 and ysize < 40
+
+    # on-grid geotiffs are windowed, not resampled
+    a = gdal.Open(str(normalized[0])).ReadAsArray()
+    x_off = int((750000.0 - geotransform[0]) / 30)
+    y_off = int((geotransform[3] - 4440000.0) / 30)
+    source = np.arange(1, 1601, dtype=np.float32).reshape(40, 40)
+    if extents == 'max':
+        assert np.array_equal(a[y_off:y_off + 40, x_off:x_off + 40], source)
+
+
+def test_normalize_stack_projection_duplicate_names(tmp_path, make_tif):
+    (tmp_path / 'd1').mkdir()
+    (tmp_path / 'd2').mkdir()
+    tifs = [make_tif(tmp_path / 'd1' / 'a.tif', np.ones((10, 10)), ulx=750000.0),
+            make_tif(tmp_path / 'd2' / 'a.tif', np.ones((10, 10)), ulx=750300.0)]
+    normalized = gdal_wrap.normalize_stack_projection(tifs, output_dir=tmp_path / 'out')
+    assert len(set(normalized)) == 2
+
+
+def test_build_time_series_vrt(make_tif):
+    names = ['20210103_VV', '20210101_VH', '20210101_VV', '20210102_VV']
+    tifs = [make_tif(f"/vsimem/S1A_IW_{date}T120000_DVP_RTC30_{pol}.tif", np.full((10, 12), i + 1),
+                     ulx=500000.0 + 30 * i)
+            for i, (date, pol) in enumerate(name.split('_') for name in names)]
+
+    vrt = gdal_wrap.build_time_series_vrt(tifs, extents='common', in_memory=True)
+    assert vrt.startswith('/vsimem/')
+    other = gdal_wrap.build_time_series_vrt(tifs[:2], in_memory=True)
+    assert other != vrt
+    gdal.Unlink(other)
+    raster = gdal.Open(vrt)
+    assert raster.RasterCount == 4
+    descriptions = [raster.GetRasterBand(i).GetDescription() for i in range(1, 5)]
+    assert descriptions == ['20210101T120000_VH', '20210101T120000_VV', '20210102T120000_VV', '20210103T120000_VV']
+    metadata = raster.GetRasterBand(1).GetMetadata()
+    assert metadata['ACQUISITION_DATE'] == '20210101T120000'
+    assert metadata['POLARIZATION'] == 'VH'
+    assert metadata['SOURCE'] == tifs[1]
+
+    # common extents of the 4 shifted tifs are 9 columns wide
+    block = raster.ReadAsArray(0, 0, 9, 10)
+    assert block.shape == (4, 10, 9)
+    assert [band[0, 0] for band in block] == [2, 3, 4, 1]
+    raster = None
+    gdal.Unlink(vrt)
+
+
+def test_build_time_series_vrt_needs_output(make_tif):
+    tif = make_tif('/vsimem/S1A_IW_20210101T120000_VV.tif', np.ones((10, 10)))
+    with pytest.raises(ValueError):
+        gdal_wrap.build_time_series_vrt([tif])
+
+
+def test_dataset_pool_is_bounded(tmp_path, make_tif, monkeypatch):
+    pool = gdal_wrap._DatasetPool(max_open=2)
+    monkeypatch.setattr(gdal_wrap, '_dataset_pool', pool)
+    tifs = [make_tif(tmp_path / f"pool_{i}.tif", np.full((16, 16), i + 1)) for i in range(5)]
+
+    for _ in range(2):
+        for i, tif in enumerate(tifs):
+            assert gdal_wrap.read_window(tif, 0, 0, 4, 4)[0, 0] == i + 1
+            assert pool.open_count <= 2
+
+    with pool.lend(tifs[0]) as first, pool.lend(tifs[0]) as second:
+        # a raster lent to one reader is not shared with another
+        assert first is not second
+    assert pool.open_count == 2
+
+    gdal_wrap.close_datasets(tifs[:1])
+    assert pool.open_count == 0
+    gdal_wrap.read_window(tifs[1], 0, 0, 4, 4)
+    gdal_wrap.close_datasets()
+    assert pool.open_count == 0
+
+
+def test_dataset_pool_reopens_rewritten_rasters(tmp_path, make_tif, monkeypatch):
+    pool = gdal_wrap._DatasetPool(max_open=4)
+    monkeypatch.setattr(gdal_wrap, '_dataset_pool', pool)
+    tif = make_tif(tmp_path / 'rewritten.tif', np.ones((16, 16)))
+    assert gdal_wrap.read_window(tif, 0, 0, 4, 4)[0, 0] == 1
+
+    make_tif(tif, np.full((16, 16), 2))
+    stat = Path(tif).stat()
+    os.utime(tif, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert gdal_wrap.read_window(tif, 0, 0, 4, 4)[0, 0] == 2
+    assert pool.open_count == 1
+
+    with pytest.raises(FileNotFoundError):
+        gdal_wrap.read_window(tmp_path / 'missing.tif', 0, 0, 4, 4)
+    assert pool.open_count == 1
+
+
+def test_stale_validity_mask(tmp_path, make_tif, monkeypatch):
+    pool = gdal_wrap._DatasetPool(max_open=4)
+    monkeypatch.setattr(gdal_wrap, '_dataset_pool', pool)
+    tif = make_tif(tmp_path / 'stale.tif', np.ones((10, 10)))
+    gdal_wrap.write_validity_masks([tif])
+    assert pool.open_count == 0
+    assert gdal_wrap.get_empty_tifs([tif]) == []
+
+    make_tif(tif, np.zeros((10, 10)))
+    tif_mtime = Path(tif).stat().st_mtime_ns
+    os.utime(f"{tif}.valid.npy", ns=(tif_mtime - 10**10, tif_mtime - 10**10))
+    with pytest.raises(ValueError, match='older'):
+        gdal_wrap.get_empty_tifs([tif])
+    with pytest.raises(ValueError, match='older'):
+        gdal_wrap.get_coverage_count([tif])
+
+    gdal_wrap.write_validity_masks([tif])
+    assert gdal_wrap.get_empty_tifs([tif]) == [Path(tif)]
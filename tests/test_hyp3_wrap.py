@@ -0,0 +1,36 @@
+from datetime import date, datetime
+
+import pytest
+
+hyp3_sdk = pytest.importorskip('hyp3_sdk')
+
+import opensarlab_lib.hyp3_wrap as hyp3_wrap
+
+
+def _job(job_id, *granule_dates):
+    granules = [f"S1A_IW_GRDH_1SDV_{dt}T120000_{dt}T120030_000000_000000_0000" for dt in granule_dates]
+    return hyp3_sdk.Job(job_type='INSAR_GAMMA', job_id=job_id, request_time=datetime(2022, 1, 1),
+                        status_code='SUCCEEDED', user_id='user', job_parameters={'granules': granules})
+
+
+def test_get_jobs_by_date():
+    jobs = hyp3_sdk.Batch([_job('a', '20210301', '20210101'), _job('b', '20210101'), _job('c', '20210201')])
+    jobs_by_date = hyp3_wrap.get_jobs_by_date(jobs)
+    assert list(jobs_by_date) == ['20210101', '20210201', '20210301']
+    assert [len(jobs_by_date[dt]) for dt in jobs_by_date] == [2, 1, 1]
+
+
+def test_filter_jobs_by_date_index():
+    jobs = hyp3_sdk.Batch([_job('a', '20210301', '20210101'), _job('b', '20210101'), _job('c', '20210201')])
+    jobs_by_date = hyp3_wrap.get_jobs_by_date(jobs)
+
+    filtered = hyp3_wrap.filter_jobs_by_date_index(jobs_by_date, [date(2021, 1, 1), date(2021, 3, 1)])
+    assert sorted(job.job_id for job in filtered) == ['a', 'b', 'c']
+
+    filtered = hyp3_wrap.filter_jobs_by_date_index(jobs_by_date, [date(2021, 1, 15), date(2021, 2, 28)])
+    assert [job.job_id for job in filtered] == ['c']
+
+    for date_range in ([date(2021, 1, 1), date(2021, 1, 31)], [date(2021, 2, 15), date(2021, 3, 31)]):
+        expected = hyp3_wrap.filter_jobs_by_date(jobs, date_range)
+        filtered = hyp3_wrap.filter_jobs_by_date_index(jobs_by_date, date_range)
+        assert sorted(job.job_id for job in filtered) == sorted(job.job_id for job in expected)
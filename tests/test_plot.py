@@ -0,0 +1,109 @@
+import numpy as np
+import pytest
+
+gdal = pytest.importorskip('osgeo.gdal')
+
+import opensarlab_lib.plot as plot
+from opensarlab_lib.tile_cache import TileCache
+
+
+def test_display_histogram_merge_and_percentile(tmp_path):
+    rng = np.random.default_rng(0)
+    values = np.concatenate([rng.lognormal(-2, 1, 50_000), -rng.lognormal(0, 1, 10_000), [0, np.nan]])
+    halves = plot.DisplayHistogram(), plot.DisplayHistogram()
+    halves[0].update(values[::2])
+    halves[1].update(values[1::2])
+    merged = halves[0].merge(halves[1])
+
+    whole = plot.DisplayHistogram()
+    whole.update(values)
+    np.testing.assert_array_equal(merged.counts, whole.counts)
+    assert merged.counts.sum() == values.size - 1
+
+    q = [1, 25, 50, 75, 99]
+    np.testing.assert_allclose(merged.percentile(q), np.nanpercentile(values, q), rtol=0.01)
+
+    merged.save(tmp_path / 'histogram.npz')
+    np.testing.assert_array_equal(plot.DisplayHistogram.load(tmp_path / 'histogram.npz').counts, merged.counts)
+    with pytest.raises(ValueError, match='layout'):
+        merged.merge(plot.DisplayHistogram(bins_per_sign=16))
+    assert np.isnan(plot.DisplayHistogram().percentile(50))
+
+
+def test_raster_histogram_samples_every_row(tmp_path, make_tif):
+    # values vary by row, so sampling only part of the raster skews the display limits
+    data = np.repeat(np.arange(1, 257, dtype=np.float32)[:, None], 64, axis=1)
+    tif = make_tif(tmp_path / 'rows.tif', data)
+
+    histogram = plot._get_raster_histogram(tif, max_pixels=512)
+    assert histogram.counts.sum() <= 2 * 512
+    vmin, vmax = histogram.percentile([1, 99])
+    assert vmin < 20 and vmax > 230
+
+    cached = plot._get_raster_histogram(tif, max_pixels=512, cache=TileCache(tmp_path / 'cache'))
+    vmin, vmax = cached.percentile([1, 99])
+    assert vmin < 20 and vmax > 230
+
+
+def test_get_stack_display_limits(tmp_path, make_tif):
+    rng = np.random.default_rng(1)
+    data = rng.uniform(1, 2, size=(3, 48, 48)).astype(np.float32)
+    data[:, :8] = 0
+    tifs = [make_tif(tmp_path / f"limits_{i}.tif", layer) for i, layer in enumerate(data)]
+
+    vmin, vmax = plot.get_stack_display_limits(tifs, percentiles=(1, 99), max_workers=2)
+    expected = np.percentile(data[data != 0], [1, 99])
+    np.testing.assert_allclose([vmin, vmax], expected, rtol=0.01)
+
+
+@pytest.fixture
+def shape_in_stack(tmp_path):
+    shapefile = pytest.importorskip('shapefile')
+    pytest.importorskip('cartopy')
+    max_extents = [-13630000.0, 4540000.0, -13600000.0, 4570000.0]
+    common_extents = [-13625000.0, 4545000.0, -13605000.0, 4565000.0]
+    try:
+        plot._load_map_sources([plot._get_map_scale(plot._get_padded_extent(max_extents))])
+    except OSError as e:
+        pytest.skip(f"Natural Earth data is unavailable: {e}")
+
+    path = tmp_path / 'aoi.shp'
+    with shapefile.Writer(str(path), shapeType=shapefile.POLYGON) as writer:
+        writer.field('name', 'C')
+        writer.poly([[(565000.0, 4150000.0), (575000.0, 4150000.0), (575000.0, 4140000.0),
+                      (565000.0, 4140000.0), (565000.0, 4150000.0)]])
+        writer.record('aoi')
+    return {'shapefile_path': path, 'src_crs': '32610',
+            'max_extents': max_extents, 'common_extents': common_extents}
+
+
+def test_render_shape_in_stack(tmp_path, shape_in_stack):
+    png = plot.render_shape_in_stack(**shape_in_stack, figsize=(4, 4), dpi=50)
+    assert png.startswith(b'\x89PNG')
+
+    output = plot.render_shape_in_stack(**shape_in_stack, figsize=(4, 4), dpi=50, output=tmp_path / 'map.png')
+    assert output == tmp_path / 'map.png'
+    assert output.read_bytes().startswith(b'\x89PNG')
+
+
+def test_render_shapes_in_stacks(tmp_path, shape_in_stack):
+    previews = [dict(shape_in_stack, figsize=(4, 4), dpi=50),
+                dict(shape_in_stack, figsize=(4, 4), dpi=50, output=tmp_path / 'map.png')]
+    png, output = plot.render_shapes_in_stacks(previews, max_workers=2)
+    assert png.startswith(b'\x89PNG')
+    assert output == tmp_path / 'map.png'
+    assert output.read_bytes().startswith(b'\x89PNG')
+
+
+def test_render_shapes_in_stacks_map_source_error(monkeypatch):
+    pytest.importorskip('cartopy')
+
+    def unavailable(scale):
+        raise OSError('Natural Earth data is unavailable')
+
+    monkeypatch.setattr(plot, '_get_map_features', unavailable)
+    preview = {'shapefile_path': 'aoi.shp', 'src_crs': '32610',
+               'max_extents': [-13630000.0, 4540000.0, -13600000.0, 4570000.0],
+               'common_extents': [-13625000.0, 4545000.0, -13605000.0, 4565000.0]}
+    with pytest.raises(OSError, match='Natural Earth'):
+        plot.render_shapes_in_stacks([preview, preview], max_workers=2)
@@ -0,0 +1,88 @@
+import numpy as np
+import pytest
+
+gdal = pytest.importorskip('osgeo.gdal')
+xr = pytest.importorskip('xarray')
+pytest.importorskip('dask')
+pytest.importorskip('zarr')
+
+import opensarlab_lib.stack_export as stack_export
+
+
+@pytest.fixture
+def stack(tmp_path, make_tif):
+    rng = np.random.default_rng(0)
+    tifs = {}
+    for day in range(1, 6):
+        for pol in ('VV', 'VH'):
+            name = f"S1A_IW_202101{day:02d}T120000_DVP_RTC30_G_gpuned_ABCD_{pol}.tif"
+            tifs[(day, pol)] = make_tif(tmp_path / name, rng.uniform(1, 2, size=(20, 30)))
+    return tifs
+
+
+def test_export_stack_to_zarr(tmp_path, stack):
+    store = stack_export.export_stack_to_zarr(list(stack.values()), tmp_path / 'stack.zarr', chunks=(2, 8, 8))
+    with xr.open_zarr(store) as ds:
+        assert sorted(ds.data_vars) == ['VH', 'VV']
+        assert ds.VV.shape == (5, 20, 30)
+        assert ds.VV.encoding['chunks'] == (2, 8, 8)
+        assert ds.time.values[0] == np.datetime64('2021-01-01T12:00:00')
+        assert ds.x.values[0] == 500015.0 and ds.y.values[0] == 3999985.0
+        assert 'crs_wkt' in ds.spatial_ref.attrs
+        np.testing.assert_array_equal(ds.VH.isel(time=3).values, gdal.Open(stack[(4, 'VH')]).ReadAsArray())
+
+
+def test_export_stack_to_zarr_append(tmp_path, stack):
+    first = [tif for (day, _), tif in stack.items() if day <= 3]
+    store = stack_export.export_stack_to_zarr(first, tmp_path / 'stack.zarr', chunks=(2, 8, 8))
+    # 3 dates fill one and a half time chunks, so the append must first fill the partial chunk
+    stack_export.export_stack_to_zarr(list(stack.values()), store, chunks=(2, 8, 8), append=True)
+
+    with xr.open_zarr(store) as ds:
+        assert ds.sizes['time'] == 5
+        assert ds.VV.encoding['chunks'] == (2, 8, 8)
+        assert (np.diff(ds.time.values) > np.timedelta64(0)).all()
+        for day in range(1, 6):
+            np.testing.assert_array_equal(ds.VV.isel(time=day - 1).values,
+                                          gdal.Open(stack[(day, 'VV')]).ReadAsArray())
+
+
+def test_export_stack_to_zarr_append_older(tmp_path, stack):
+    last = [tif for (day, _), tif in stack.items() if day >= 4]
+    store = stack_export.export_stack_to_zarr(last, tmp_path / 'stack.zarr', chunks=(2, 8, 8))
+    with pytest.raises(ValueError, match='Only acquisitions after'):
+        stack_export.export_stack_to_zarr(list(stack.values()), store, chunks=(2, 8, 8), append=True)
+
+
+def test_export_stack_to_zarr_append_uses_store_chunks(tmp_path, stack):
+    first = [tif for (day, _), tif in stack.items() if day <= 3]
+    store = stack_export.export_stack_to_zarr(first, tmp_path / 'stack.zarr', chunks=(2, 8, 8))
+    # dask chunks of 12 pixels would straddle the store's 8 pixel chunks, so the passed chunks must be ignored
+    stack_export.export_stack_to_zarr(list(stack.values()), store, chunks=(3, 12, 12), append=True)
+
+    with xr.open_zarr(store) as ds:
+        assert ds.sizes['time'] == 5
+        assert ds.VV.encoding['chunks'] == (2, 8, 8)
+        np.testing.assert_array_equal(ds.VH.isel(time=4).values, gdal.Open(stack[(5, 'VH')]).ReadAsArray())
+
+
+def test_export_stack_to_zarr_append_other_projection(tmp_path, make_tif, stack):
+    from opensarlab_lib.custom_exceptions import ProjectionError
+
+    first = [tif for (day, _), tif in stack.items() if day <= 3]
+    store = stack_export.export_stack_to_zarr(first, tmp_path / 'stack.zarr', chunks=(2, 8, 8))
+    # same grid numbers, different UTM zone
+    (tmp_path / 'other').mkdir()
+    other = [make_tif(tmp_path / 'other' / f"S1A_IW_20210109T120000_DVP_RTC30_G_gpuned_ABCD_{pol}.tif",
+                      np.ones((20, 30)), epsg=32611)
+             for pol in ('VV', 'VH')]
+    with pytest.raises(ProjectionError):
+        stack_export.export_stack_to_zarr(other, store, append=True)
+
+
+def test_export_stack_to_zarr_duplicate_acquisitions(tmp_path, make_tif, stack):
+    (tmp_path / 'copy').mkdir()
+    duplicate = make_tif(tmp_path / 'copy' / 'S1A_IW_20210101T120000_DVP_RTC30_G_gpuned_ABCD_VV.tif',
+                         np.ones((20, 30)))
+    with pytest.raises(ValueError, match='both VV acquisitions'):
+        stack_export.export_stack_to_zarr(list(stack.values()) + [duplicate], tmp_path / 'stack.zarr')
@@ -0,0 +1,106 @@
+import warnings
+
+import numpy as np
+import pytest
+
+gdal = pytest.importorskip('osgeo.gdal')
+
+import opensarlab_lib.temporal_stats as temporal_stats
+
+
+@pytest.fixture
+def stack(make_tif):
+    rng = np.random.default_rng(0)
+    data = rng.uniform(1, 2, size=(5, 40, 50)).astype(np.float32)
+    data[1, :10, :10] = 0
+    data[3, 20:, 5] = np.nan
+    data[:, 0, 0] = 0
+    tifs = [make_tif(f"/vsimem/temporal_stats_{i}.tif", layer) for i, layer in enumerate(data)]
+    data[data == 0] = np.nan
+    return tifs, data
+
+
+def _read(path):
+    return gdal.Open(str(path)).ReadAsArray()
+
+
+def test_compute_temporal_stats(tmp_path, stack):
+    tifs, data = stack
+    outputs = temporal_stats.compute_temporal_stats(tifs, tmp_path, percentiles=[10, 50], block_size=16, max_workers=3)
+
+    with warnings.catch_warnings():
+        # pixel (0, 0) is nodata on every date
+        warnings.simplefilter('ignore', RuntimeWarning)
+        expected = {
+            'mean': np.nanmean(data, axis=0),
+            'std': np.nanstd(data, axis=0),
+            'min': np.nanmin(data, axis=0),
+            'max': np.nanmax(data, axis=0),
+            'count': np.sum(~np.isnan(data), axis=0),
+            'p10': np.nanpercentile(data, 10, axis=0),
+            'p50': np.nanpercentile(data, 50, axis=0),
+        }
+        expected['cv'] = expected['std'] / expected['mean']
+    assert set(outputs) == set(expected)
+    for stat, values in expected.items():
+        np.testing.assert_allclose(_read(outputs[stat]), values, rtol=1e-5, atol=1e-6, equal_nan=True)
+    assert np.isnan(_read(outputs['mean'])[0, 0])
+    assert _read(outputs['count'])[0, 0] == 0
+
+
+def test_compute_temporal_stats_unaligned(tmp_path, make_tif):
+    tifs = [make_tif('/vsimem/unaligned_0.tif', np.ones((10, 10))),
+            make_tif('/vsimem/unaligned_1.tif', np.ones((10, 10)), ulx=500030.0)]
+    with pytest.raises(ValueError, match='pixel-aligned'):
+        temporal_stats.compute_temporal_stats(tifs, tmp_path)
+
+
+def test_get_stack_windows():
+    windows = list(temporal_stats._get_stack_windows(1000, 700, (256, 256), 512))
+    assert windows[:3] == [(0, 0, 512, 512), (512, 0, 488, 512), (0, 512, 512, 188)]
+    covered = np.zeros((700, 1000), dtype=int)
+    for xoff, yoff, xsize, ysize in windows:
+        covered[yoff:yoff + ysize, xoff:xoff + xsize] += 1
+    assert (covered == 1).all()
+
+
+def test_compute_temporal_stats_stack_larger_than_dataset_pool(tmp_path, make_tif, monkeypatch):
+    import opensarlab_lib.gdal_wrap as gdal_wrap
+
+    pool = gdal_wrap._DatasetPool(max_open=3)
+    monkeypatch.setattr(gdal_wrap, '_dataset_pool', pool)
+    open_dataset = gdal_wrap.gdal.Open
+    peak = []
+
+    def counting_open(path):
+        peak.append(pool.open_count)
+        return open_dataset(path)
+
+    monkeypatch.setattr(gdal_wrap.gdal, 'Open', counting_open)
+    rng = np.random.default_rng(2)
+    data = rng.uniform(1, 2, size=(8, 32, 32)).astype(np.float32)
+    tifs = [make_tif(tmp_path / f"pooled_{i}.tif", layer) for i, layer in enumerate(data)]
+
+    outputs = temporal_stats.compute_temporal_stats(tifs, tmp_path / 'stats', stats=['mean'],
+                                                    block_size=16, max_workers=2)
+    np.testing.assert_allclose(_read(outputs['mean']), data.mean(axis=0), rtol=1e-5)
+    # at most one dataset per worker beyond the pool's bound is ever open
+    assert peak and max(peak) <= 3 + 2
+    assert pool.open_count == 0
+
+
+def test_compute_temporal_stats_percentile_memory(tmp_path, stack):
+    tifs, data = stack
+    # room for one 16 x 16 block of every date per worker, so 512 pixel blocks must shrink
+    budget = 4 * len(tifs) * 16 * 16 * 2
+    outputs = temporal_stats.compute_temporal_stats(tifs, tmp_path / 'bounded', stats=[], percentiles=[50],
+                                                    block_size=512, max_workers=2, max_percentile_bytes=budget)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        expected = np.nanpercentile(data, 50, axis=0)
+    np.testing.assert_allclose(_read(outputs['p50']), expected, rtol=1e-5, equal_nan=True)
+
+    with pytest.raises(ValueError, match='max_percentile_bytes'):
+        temporal_stats.compute_temporal_stats(tifs, tmp_path / 'too_small', percentiles=[50],
+                                              max_workers=2, max_percentile_bytes=budget - 1)
+    assert not (tmp_path / 'too_small').exists()
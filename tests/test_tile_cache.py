@@ -0,0 +1,92 @@
+import os
+
+import numpy as np
+import pytest
+
+gdal = pytest.importorskip('osgeo.gdal')
+
+from opensarlab_lib.gdal_wrap import read_window
+import opensarlab_lib.temporal_stats as temporal_stats
+from opensarlab_lib.tile_cache import TileCache
+
+
+@pytest.fixture
+def tif(tmp_path, make_tif):
+    data = np.arange(40 * 48, dtype=np.float32).reshape(40, 48) + 1
+    return make_tif(tmp_path / 'source.tif', data), data
+
+
+def test_read_window_hits_and_misses(tmp_path, tif):
+    tif, data = tif
+    cache = TileCache(tmp_path / 'cache')
+
+    np.testing.assert_array_equal(cache.read_window(tif, 5, 10, 20, 12), data[10:22, 5:25])
+    # the window spans 2 x 2 of the 16 x 16 blocks
+    assert (cache.hits, cache.misses) == (0, 4)
+    np.testing.assert_array_equal(cache.read_window(tif, 0, 0, 48, 40), data)
+    assert (cache.hits, cache.misses) == (4, 9)
+    assert cache.stats()['blocks'] == 9
+    np.testing.assert_array_equal(read_window(tif, 3, 4, 30, 30, cache=cache), read_window(tif, 3, 4, 30, 30))
+
+    with pytest.raises(ValueError, match='outside'):
+        cache.read_window(tif, 40, 0, 16, 16)
+
+
+def test_evicts_only_its_own_tiles(tmp_path, tif):
+    tif, data = tif
+    cache_dir = tmp_path / 'cache'
+    cache_dir.mkdir()
+    foreign = [cache_dir / 'source.valid.npy', cache_dir / 'notes.npy']
+    for path in foreign:
+        np.save(path, np.zeros(1000))
+
+    block_bytes = TileCache(tmp_path / 'sizing').read_block(tif, 0, 0).nbytes
+    cache = TileCache(cache_dir, max_bytes=3 * block_bytes + 500)
+    np.testing.assert_array_equal(cache.read_window(tif, 0, 0, 48, 40), data)
+
+    assert 0 < cache.nbytes <= cache.max_bytes
+    assert len(list(cache_dir.glob('*.tile.npy'))) == cache.stats()['blocks'] < 9
+    assert all(path.exists() for path in foreign)
+    cache.clear()
+    assert all(path.exists() for path in foreign)
+    assert not list(cache_dir.glob('*.tile.npy'))
+
+
+def test_adopts_existing_tiles(tmp_path, tif):
+    tif, data = tif
+    TileCache(tmp_path / 'cache').read_window(tif, 0, 0, 48, 40)
+
+    cache = TileCache(tmp_path / 'cache')
+    assert cache.stats()['blocks'] == 9
+    np.testing.assert_array_equal(cache.read_window(tif, 0, 0, 48, 40), data)
+    assert (cache.hits, cache.misses) == (9, 0)
+
+
+def test_rewritten_source_is_not_stale(tmp_path, make_tif, tif):
+    tif, data = tif
+    cache = TileCache(tmp_path / 'cache')
+    np.testing.assert_array_equal(read_window(tif, 0, 0, 16, 16, cache=cache), data[:16, :16])
+    np.testing.assert_array_equal(read_window(tif, 0, 0, 16, 16), data[:16, :16])
+
+    make_tif(tif, -data)
+    stat = os.stat(tif)
+    os.utime(tif, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    np.testing.assert_array_equal(read_window(tif, 0, 0, 16, 16, cache=cache), -data[:16, :16])
+    np.testing.assert_array_equal(read_window(tif, 0, 0, 16, 16), -data[:16, :16])
+    assert cache.misses == 2
+
+
+def test_compute_temporal_stats_with_cache(tmp_path, make_tif):
+    rng = np.random.default_rng(1)
+    tifs = [make_tif(tmp_path / f"stack_{i}.tif", rng.uniform(1, 2, size=(40, 48))) for i in range(3)]
+    cache = TileCache(tmp_path / 'cache')
+
+    uncached = temporal_stats.compute_temporal_stats(tifs, tmp_path / 'uncached', block_size=16)
+    cached = temporal_stats.compute_temporal_stats(tifs, tmp_path / 'cached', block_size=16, cache=cache)
+    for stat in uncached:
+        np.testing.assert_array_equal(gdal.Open(str(cached[stat])).ReadAsArray(),
+                                      gdal.Open(str(uncached[stat])).ReadAsArray())
+    assert cache.misses == 3 * 9
+
+    with pytest.raises(ValueError, match='processes'):
+        temporal_stats.compute_temporal_stats(tifs, tmp_path / 'cached', use_processes=True, cache=cache)
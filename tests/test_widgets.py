@@ -0,0 +1,48 @@
+import asyncio
+from datetime import datetime
+import importlib
+
+import pytest
+
+pytest.importorskip('ipywidgets')
+
+# opensarlab_lib re-exports ipywidgets as `widgets`, shadowing the submodule attribute
+widgets = importlib.import_module('opensarlab_lib.widgets')
+
+
+def test_gui_acquisition_date_picker():
+    slider = widgets.gui_acquisition_date_picker(['20210113', '20210101', '20210101', '20210301'])
+    assert [label for label, _ in slider.options] == [' 01/01/2021 (2) ', ' 01/13/2021 (1) ', ' 03/01/2021 (1) ']
+    assert widgets.get_slider_vals(slider) == [datetime(2021, 1, 1), datetime(2021, 3, 1)]
+
+
+def test_gui_acquisition_date_picker_bins():
+    slider = widgets.gui_acquisition_date_picker({'20210113': 3, '20210101': 2, '20210301': 1}, bin_freq='M')
+    assert [label for label, _ in slider.options] == [' 01/01/2021 (5) ', ' 03/01/2021 (1) ']
+    slider_min, slider_max = widgets.get_slider_vals(slider)
+    assert slider_min == datetime(2021, 1, 1)
+    assert slider_max.date() == datetime(2021, 3, 31).date()
+
+
+def test_throttle_coalesces_calls():
+    calls = []
+
+    async def drag():
+        throttle = widgets._Throttle(calls.append, 0.1)
+        for value in range(30):
+            throttle(value)
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.2)
+
+    asyncio.run(drag())
+    assert calls[0] == 0
+    assert calls[-1] == 29
+    assert 2 <= len(calls) <= 6
+
+
+def test_throttle_without_event_loop():
+    calls = []
+    throttle = widgets._Throttle(calls.append, 10)
+    for value in range(3):
+        throttle(value)
+    assert calls == [0, 1, 2]